@@ -6,12 +6,32 @@ function base64url_encode($data) {
 function encode($data) {
   return base64url_encode(gzcompress($data));
 }
+function simulate($ex,$n) { // forward to des_server.py (python des_server.py 8008)
+  $context = stream_context_create(["http"=>["method"=>"POST","timeout"=>70,"ignore_errors"=>true,
+    "header"=>"Content-Type: application/x-www-form-urlencoded",
+    "content"=>http_build_query(["ex"=>$ex,"n"=>$n,"format"=>"json","what"=>"stats,bpmn,bpmn_svg,svg,dot"])]]);
+  $s = @file_get_contents("http://127.0.0.1:8008/simulate",false,$context);
+  if($s===false) return false;
+  $r = json_decode($s,true);
+  if(!is_array($r)) return "<pre>".htmlspecialchars($s)."</pre>"; // model error or limit reported by the server
+  file_put_contents("des.bpmn",$r["bpmn"]); // last run files linked by des.html
+  file_put_contents("des.dot",$r["dot"]);
+  $hw = $r["hw"]===null ? "" : " +/- ".$r["hw"];
+  return "<pre>".$r["mean"].$hw." (n=".$r["n"].")\n".json_encode($r["S"])."\n".$r["stats"]."</pre>\n".
+         ($r["out"]!=="" ? "<pre>".htmlspecialchars($r["out"])."</pre>\n" : "").
+         "<div>".$r["bpmn_svg"]."</div>\n<div>".$r["svg"]."</div>\n";
+}
 if(array_key_exists("ex",$_REQUEST)) {
+	$out=simulate($_REQUEST["ex"],array_key_exists("n",$_REQUEST)?$_REQUEST["n"]:1);
+	if($out!==false) {
+		echo $out;
+	} else { // no server running (-u: model of a visitor, not trusted)
 	file_put_contents("des.in",$_REQUEST["ex"]);
-	echo "<pre>".shell_exec('C:\Users\marmo\AppData\Local\Programs\Python\Python39\python.exe des.py des.in')."</pre>";
+	echo "<pre>".shell_exec('C:\Users\marmo\AppData\Local\Programs\Python\Python39\python.exe des.py -u des.in')."</pre>";
 	echo "<div>".file_get_contents("des_bpmn.svg")."</div>";
 	//echo "<pre>".file_get_contents("des.out")."</prev>";
 	echo "<div>".file_get_contents("des.svg")."</div>";
+	}
 } else if(array_key_exists("dot",$_REQUEST)) {
 	$dot=file_get_contents($_REQUEST["dot"]);
 	$enco=encode($dot);
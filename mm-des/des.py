@@ -1,7 +1,13 @@
 # DES - discrete event (micro) simulator
 # - basic events: Generator,Service,Sink,ConditionalEvent
-# - bpmn events: Start,Task,End,Timer,XorGate,AndGate,Condition
+# - bpmn events: Start,Task,End,Timer,XorGate,AndGate,OrGate,Condition,Seize,Release
 # MM 31.1.2024
+VERSION = "1.1"
+def _engine():  # version and hash of this source (results of another des.py are not reused)
+      import hashlib
+      with open(__file__,"rb") as fp:
+            return VERSION+"-"+hashlib.sha256(fp.read()).hexdigest()[:12]
+ENGINE = _engine()
 
 # ---- simulation on an abstract event ----
 class Event():
@@ -19,6 +25,9 @@ class Simulator():
             self.time = 0
             self.events = []
             self.conditions = []
+            self.wakes = []       # resource pools released during the last event
+            self.n = 0            # executed events
+            self.t0 = 0           # time of the previous event
       def now(self):
             return self.time
       def add(self,e):
@@ -27,31 +36,68 @@ class Simulator():
       def add_condition(self,e):
             self.conditions.append(e)
             return(self)
-      def run(self):
-            while self.events:
+      def step(self,n=1,tmax=None):       # execute at most n events not later than tmax
+            k = 0
+            while k<n and self.events:
                   e = min(self.events, key=lambda e: e.time)
+                  if tmax!=None and e.time>tmax:
+                        self.time = tmax       # paused
+                        break
                   self.events.remove(e)
-                  self.time = e.time         # update simulator time
+                  self.t0,self.time = self.time,e.time  # update simulator time
                   e.exec(self)
+                  while self.wakes:          # hand released resources over
+                        self.wakes.pop().wake(self)
                   for c in self.conditions:  # test conditions
                         if c.exec(self):
                               self.conditions.remove(c)
+                  k += 1
+            self.n += k
+            return k
+      def run(self,tmax=None):            # until no events (or paused at time tmax)
+            self.step(float("inf"),tmax)
+      def run_until(self,t):
+            self.run(t)
+      def iterate(self,k=1000,tmax=None): # cooperative run yielding progress every k events
+            while True:
+                  m = self.step(k,tmax)
+                  yield {"time":self.time,"n":self.n,"events":len(self.events),
+                         "done":None if tmax is None else (self.time/tmax if tmax else 1.0)}
+                  if m<k:
+                        return
 # ---- utils ----
-import math,random
+import math,random,re,heapq,ast
+from collections import deque,ChainMap
 def _print(s):                # own print
       #print(s)               # comment if no verbous printing
       pass
+class Stream(random.Random): # seedable random substream (antithetic: 1-u)
+      def __init__(self,key,anti=False):
+            self.anti = anti
+            random.Random.__init__(self,key)
+      def __reduce__(self):           # picklable (snapshots)
+            return (Stream,(0,self.anti),self.getstate())
+      def random(self):
+            u = random.Random.random(self)
+            return self.anti and u>0 and 1.0-u or u
+RNG = {"seed":None,"anti":False} # None - single global random stream
+_rng = random                 # stream used by random generators (set by nodes)
+def set_seed(seed=None,anti=False):  # per node and purpose streams derived from seed
+      global _rng
+      RNG["seed"],RNG["anti"],_rng = seed,anti,random
+      if seed!=None:
+            random.seed(seed)
 def E(mean=[1.0]):            # exponential random generator
-      # -mean[0]*math.log(random.random())
-      return random.expovariate(1/mean[0]) 
+      # -mean[0]*math.log(_rng.random())
+      return _rng.expovariate(1/mean[0]) 
 def U(minmax=[1.0]):          # uniform random generator
-      return random.uniform(minmax[0],len(minmax)>1 and minmax[1] or minmax[0])
+      return _rng.uniform(minmax[0],len(minmax)>1 and minmax[1] or minmax[0])
 def N(meanstd=[3.0]):        # gaussian random generator
-      return random.normalvariate(meanstd[0],len(meanstd)>1 and meanstd[1] or 1.0)
+      return _rng.normalvariate(meanstd[0],len(meanstd)>1 and meanstd[1] or 1.0)
 def B(p=0.5):                # binomial (0,1)
-      return random.random()<p
+      return _rng.random()<p
 def C(p=[1,1,1]):            # choice (0,1,2,...)
-      return random.choices(list(range(len(p))),weights=p)[0]
+      return _rng.choices(list(range(len(p))),weights=p)[0]
 def T(minmax=[1.0]):          # semi truncated gaussian random generator
       mi,ma = minmax[0],len(minmax)>1 and minmax[1] or minmax[0]
       mean,std = (ma+mi)/2,(ma-mi)/2
@@ -59,6 +105,350 @@ def T(minmax=[1.0]):          # semi truncated gaussian random generator
             x = N([mean,std])
             if mi <= x <= ma: break
       return x
+class Rate():                 # piecewise rate l(t) of non-homogeneous Poisson arrivals (Start(Rate(...)))
+      def __init__(self,t=[0.0],r=[1.0],cycle=0.0,linear=False):
+            import bisect
+            self.bisect = bisect.bisect_right
+            self.t,self.r,self.cycle,self.linear = [float(x) for x in t],[float(x) for x in r],float(cycle),linear
+            if self.t[0]>0:           # no arrivals before the first breakpoint
+                  self.t,self.r = [0.0]+self.t,[0.0]+self.r
+            self.__name__ = "Rate"
+            tt = self.t+[self.cycle if self.cycle>0 else math.inf]
+            if linear:                # rates given at breakpoints, bound of each piece for thinning
+                  rr = self.r+[self.r[0] if self.cycle>0 else self.r[-1]]
+                  self.m = [max(rr[i],rr[i+1]) for i in range(len(self.t))]
+            else:                     # rates constant over pieces, cumulative L(t) for inversion
+                  self.L = [0.0]
+                  for i in range(len(self.t)-1):
+                        self.L.append(self.L[-1]+self.r[i]*(tt[i+1]-tt[i]))
+                  self.Lc = self.L[-1]+self.r[-1]*(tt[-1]-tt[-2]) if self.cycle>0 else 0.0
+            self.tt = tt
+      def __call__(self,t):       # rate at time t
+            if self.cycle>0: t = t%self.cycle
+            i = max(self.bisect(self.t,t)-1,0)
+            if not self.linear or i+1>=len(self.t) and self.cycle<=0:
+                  return self.r[i]
+            r1 = self.r[i+1] if i+1<len(self.r) else self.r[0]
+            return self.r[i]+(r1-self.r[i])*(t-self.tt[i])/(self.tt[i+1]-self.tt[i])
+      def _L(self,t):             # cumulative rate within the cycle
+            i = max(self.bisect(self.t,t)-1,0)
+            return self.L[i]+self.r[i]*(t-self.t[i])
+      def next(self,t,rng=random):  # time of the next arrival after t
+            if self.linear:           # thinning with bound of the current piece
+                  c = self.cycle>0 and (t//self.cycle)*self.cycle or 0.0
+                  t -= c
+                  i = max(self.bisect(self.t,t)-1,0)
+                  while True:
+                        if self.m[i]<=0:
+                              t = self.tt[i+1]
+                        else:
+                              t += rng.expovariate(self.m[i])
+                              if t<self.tt[i+1]:
+                                    if rng.random()*self.m[i] <= self(t):
+                                          return c+t
+                                    continue
+                              t = self.tt[i+1]
+                        i += 1
+                        if i==len(self.t):
+                              if self.cycle<=0: return math.inf
+                              c,t,i = c+self.cycle,0.0,0
+            e = rng.expovariate(1.0)   # inversion: L(t')=L(t)+e
+            c = 0.0
+            if self.cycle>0:
+                  if self.Lc<=0: return math.inf
+                  c = (t//self.cycle)*self.cycle
+                  e += self._L(t-c)
+                  k = e//self.Lc
+                  c,e = c+k*self.cycle,e-k*self.Lc
+            else:
+                  e += self._L(t)
+            i = max(self.bisect(self.L,e)-1,0)
+            while self.r[i]<=0:       # zero rate pieces have no arrivals
+                  i += 1
+                  if i==len(self.r): return math.inf
+            return c+self.t[i]+(e-self.L[i])/self.r[i]
+class Empirical():            # sampler of measured data: inverse cdf table or alias table (discrete)
+      def __init__(self,data,discrete=False,m=1024):
+            self.__name__ = "Emp"
+            vw = [(float(d[0]),float(d[1])) if isinstance(d,(list,tuple)) else (float(d),1.0) for d in data]
+            self.discrete = discrete
+            if discrete:              # alias table (Vose) of distinct values
+                  w = {}
+                  for v,c in vw: w[v] = w.get(v,0.0)+c
+                  self.v = sorted(w)
+                  n,W = len(self.v),sum(w.values())
+                  p = [w[v]*n/W for v in self.v]
+                  self.a,self.p = list(range(n)),[1.0]*n
+                  small,large = [i for i in range(n) if p[i]<1],[i for i in range(n) if p[i]>=1]
+                  while small and large:
+                        i,j = small.pop(),large[-1]
+                        self.p[i],self.a[i] = p[i],j
+                        p[j] -= 1-p[i]
+                        if p[j]<1: small.append(large.pop())
+                  return
+            if len(data) and isinstance(data[0],(list,tuple)) and len(data[0])>2:  # histogram bins (lo,hi,count)
+                  xf,c = [(float(data[0][0]),0.0)],0.0
+                  for lo,hi,n in sorted(data):
+                        c += float(n)
+                        xf += [(float(lo),xf[-1][1]),(float(hi),c)]
+                  xf = xf[1:]
+            else:                     # (weighted) sample: cdf through the middles of the values
+                  vw.sort()
+                  W,c,xf = sum(w for v,w in vw),0.0,[]
+                  for v,w in vw:
+                        xf.append((v,c+w/2))
+                        c += w
+                  xf = [(xf[0][0],0.0)]+xf+[(xf[-1][0],c)]
+            F = xf[-1][1] or 1.0
+            self.q,j = [],0           # quantiles at m+1 equally spaced probabilities
+            for k in range(m+1):
+                  f = F*k/m
+                  while j<len(xf)-2 and xf[j+1][1]<f: j += 1
+                  (x0,f0),(x1,f1) = xf[j],xf[j+1]
+                  self.q.append(x0 if f1<=f0 else x0+(x1-x0)*min(max((f-f0)/(f1-f0),0.0),1.0))
+            self.m = m
+      def __call__(self,p=[1.0]):   # random value (p - optional [scale])
+            s = p[0] if isinstance(p,list) and p else 1.0
+            x = _rng.random()
+            if self.discrete:
+                  x *= len(self.v)
+                  i = int(x)
+                  return s*self.v[i if x-i<self.p[i] else self.a[i]]
+            x *= self.m
+            i = int(x)
+            return s*(self.q[i]+(self.q[i+1]-self.q[i])*(x-i)) if i<self.m else s*self.q[-1]
+def _load(src):               # values of a file (one value, value weight or lo hi count per line)
+      if not TRUSTED:         # however Emp or fit is reached (i.e. [Emp][0]("file"))
+            raise ModelError("data file %r only in models of the host, give a list of values"%src)
+      dd = []
+      for s in open(src):
+            s = s.split("#")[0].replace(","," ").split()
+            if s:
+                  dd.append(float(s[0]) if len(s)==1 else [float(x) for x in s])
+      return dd
+_EMP = {}                     # loaded once and shared by nodes and replications
+def Emp(src,discrete=False):  # i.e. Task(Emp("times.txt"),[1]) or Task(Emp([1,2,2,5]),[60])
+      key = (str(src),discrete)
+      if key not in _EMP or isinstance(src,str) and not TRUSTED:  # no file data loaded before by the host
+            _EMP[key] = Empirical(_load(src) if isinstance(src,str) else src,discrete)
+      return _EMP[key]
+def fit(src):                 # best of E,U,N,T by Kolmogorov distance, i.e. Task(*fit("times.txt"))
+      from statistics import NormalDist,fmean,stdev
+      dd = sorted(x if not isinstance(x,list) else x[0] for x in (_load(src) if isinstance(src,str) else src))
+      m,s,a,b = fmean(dd),stdev(dd),dd[0],dd[-1]
+      nd,td = NormalDist(m,s),NormalDist((a+b)/2,(b-a)/2 or 1)
+      tz = td.cdf(b)-td.cdf(a) or 1
+      ff = {"E":(E,[m],lambda x:1-math.exp(-x/m)),
+            "U":(U,[a,b],lambda x:(x-a)/(b-a or 1)),
+            "N":(N,[m,s],nd.cdf),
+            "T":(T,[a,b],lambda x:(td.cdf(x)-td.cdf(a))/tz)}
+      n,best = len(dd),None
+      for k,(f,p,F) in ff.items():
+            d = max(max(F(x)-i/n,(i+1)/n-F(x)) for i,x in enumerate(dd))
+            if best==None or d<best[0]:
+                  best = (d,f,p)
+      return best[1],best[2]
+def tq(p=0.975,df=10):        # Student t quantile (Cornish-Fisher expansion of normal one)
+      from statistics import NormalDist
+      z = NormalDist().inv_cdf(p)
+      if df<1: return z
+      g1 = (z**3+z)/4
+      g2 = (5*z**5+16*z**3+3*z)/96
+      g3 = (3*z**7+19*z**5+17*z**3-15*z)/384
+      g4 = (79*z**9+776*z**7+1482*z**5-1920*z**3-945*z)/92160
+      return z+g1/df+g2/df**2+g3/df**3+g4/df**4
+class Stat():                 # running mean and variance (Welford)
+      def __init__(self):
+            self.n, self.mean, self.m2 = 0, 0.0, 0.0
+            self.min, self.max = math.inf, -math.inf
+      def add(self,x):
+            self.n += 1
+            d = x-self.mean
+            self.mean += d/self.n
+            self.m2 += d*(x-self.mean)
+            self.min, self.max = min(self.min,x), max(self.max,x)
+      def merge(self,o):      # parallel (Chan et al.) combination
+            if o.n==0: return self
+            n = self.n+o.n
+            d = o.mean-self.mean
+            self.mean += d*o.n/n
+            self.m2 += o.m2+d*d*self.n*o.n/n
+            self.n = n
+            self.min, self.max = min(self.min,o.min), max(self.max,o.max)
+            return self
+      def var(self):
+            return self.n>1 and self.m2/(self.n-1) or 0.0
+      def hw(self,alpha=0.05):  # confidence interval half-width of the mean
+            return self.n>1 and tq(1-alpha/2,self.n-1)*math.sqrt(self.var()/self.n) or math.inf
+      def __str__(self):      # no half-width of a single value
+            return self.n<2 and "%g (n=%d)"%(self.mean,self.n) or "%g +/- %g (n=%d)"%(self.mean,self.hw(),self.n)
+class Sketch():               # mergeable streaming quantile sketch (KLL-like compactors)
+      def __init__(self,k=200):
+            self.k, self.n, self.c = k, 0, [[]]    # accuracy, observations, compactor levels
+            self.r = None                # own random stream (does not disturb model streams)
+      def _cap(self,h):
+            return max(2,int(self.k*(2/3)**(len(self.c)-1-h)))
+      def add(self,x):
+            self.n += 1
+            self.c[0].append(x)
+            if len(self.c[0])>=self._cap(0):
+                  self._compress()
+      def _compress(self):    # every full level passes half of its sorted items one level up
+            if self.r==None: self.r = random.Random(self.k)  # created when needed (small snapshots)
+            for h in range(len(self.c)):
+                  if len(self.c[h])>=self._cap(h):
+                        if h+1==len(self.c): self.c.append([])
+                        a = sorted(self.c[h])
+                        keep = len(a)%2 and [a.pop(self.r.randrange(len(a)))] or []
+                        self.c[h+1].extend(a[self.r.randrange(2)::2])
+                        self.c[h] = keep
+      def merge(self,o):
+            while len(self.c)<len(o.c): self.c.append([])
+            for h in range(len(o.c)):
+                  self.c[h].extend(o.c[h])
+            self.n += o.n
+            while any(len(self.c[h])>=self._cap(h) for h in range(len(self.c))):
+                  self._compress()
+            return self
+      def quantiles(self,pp=[0.5,0.95,0.99]):
+            a = sorted((x,1<<h) for h in range(len(self.c)) for x in self.c[h])
+            w = sum(x[1] for x in a)
+            qq, i, cw = {}, 0, 0
+            for p in sorted(pp):    # one pass over the sorted items
+                  while i<len(a) and cw+a[i][1]<p*w:
+                        cw += a[i][1]
+                        i += 1
+                  qq[p] = a[min(i,len(a)-1)][0] if a else math.nan
+            return [qq[p] for p in pp]  # in the order asked
+class Hist():                 # fixed-bin streaming histogram (bin width doubles when out of range)
+      def __init__(self,nb=64,w=1/16,lo=0.0):
+            self.nb, self.w, self.lo, self.c = nb, w, lo, [0]*nb
+      def add(self,x):
+            while x>=self.lo+self.nb*self.w:
+                  self._double()
+            self.c[max(int((x-self.lo)/self.w),0)] += 1
+      def _double(self):
+            self.c = [self.c[i]+self.c[i+1] for i in range(0,self.nb,2)]+[0]*(self.nb//2)
+            self.w *= 2
+      def merge(self,o):      # equal number of bins and initial width assumed
+            while self.w<o.w: self._double()
+            c, w = list(o.c), o.w
+            while w<self.w:
+                  c = [c[i]+c[i+1] for i in range(0,len(c),2)]+[0]*(len(c)//2)
+                  w *= 2
+            self.c = [a+b for a,b in zip(self.c,c)]
+            return self
+      def to_dict(self):
+            return {"lo":self.lo,"w":self.w,"c":self.c}
+      def to_svg(self,c='orange',W=320,H=160):
+            n = max([i+1 for i in range(self.nb) if self.c[i]]+[1])
+            m, bw = max(self.c) or 1, W/n
+            s = '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n'%(W+40,H+30)
+            for i in range(n):
+                  h = H*self.c[i]/m
+                  s += '<rect x="%g" y="%g" width="%g" height="%g" fill="%s" stroke="black"><title>[%g, %g): %d</title></rect>\n'%(20+i*bw,10+H-h,bw,h,c,self.lo+i*self.w,self.lo+(i+1)*self.w,self.c[i])
+            s += '<text x="20" y="%d">%g</text><text x="%d" y="%d" text-anchor="end">%g</text>\n'%(H+25,self.lo,W+20,H+25,self.lo+n*self.w)
+            return s+'</svg>\n'
+class Series():               # output series in constant memory (batch size doubles when full)
+      def __init__(self,kmax=512,dt=1.0):
+            self.kmax, self.m, self.x = kmax, 1, []  # max batches, batch size, batch means
+            self.n, self.k, self.sum = 0, 0, 0.0     # observations, in current batch, its sum
+            self.dt, self.ts, self.tl, self.v, self.area = dt, 0.0, 0.0, 0, 0.0 # time slots (hold)
+      def add(self,v):
+            self.n += 1
+            self.k += 1
+            self.sum += v
+            if self.k==self.m:
+                  self.x.append(self.sum/self.m)
+                  self.k, self.sum = 0, 0.0
+                  if len(self.x)==self.kmax:  # merge neighbouring batches
+                        self.x = [(self.x[i]+self.x[i+1])/2 for i in range(0,self.kmax,2)]
+                        self.m *= 2
+      def hold(self,t,v):     # time persistent value v since t, observed as dt slot averages
+            while t>=self.ts+self.dt:
+                  self.add((self.area+self.v*(self.ts+self.dt-self.tl))/self.dt)
+                  self.ts += self.dt
+                  self.tl, self.area = self.ts, 0.0
+            self.area += self.v*(t-self.tl)
+            self.tl, self.v = t, v
+      def mser(self):         # warm-up truncation (in batches) minimizing MSER statistic
+            x, n = self.x, len(self.x)
+            s1, s2, best, d = 0.0, 0.0, math.inf, 0
+            z = [0.0]*n     # MSER of the tail x[j:]
+            for j in range(n-1,-1,-1):
+                  s1 += x[j]
+                  s2 += x[j]*x[j]
+                  z[j] = (s2-s1*s1/(n-j))/(n-j)**2
+            for j in range(n//2):
+                  if z[j]<best: best, d = z[j], j
+            return d
+      def ci(self,alpha=0.05,b=20):  # batch means confidence interval after warm-up deletion
+            d = self.mser()
+            y = self.x[d:]
+            m = max(len(y)//b,1)
+            y = y[len(y)%m:]      # drop oldest leftover
+            st = Stat()
+            for i in range(0,len(y),m):
+                  st.add(sum(y[i:i+m])/m)
+            return {"n":self.n,"d":d*self.m,"mean":st.mean,"hw":st.hw(alpha),"b":st.n}
+class NodeStat():             # online statistics of a node (no customer traces needed)
+      def __init__(self,c=1):
+            self.n, self.c, self.t = 0, c, 0.0   # finished customers, servers, last change
+            self.q, self.qmax, self.qa = 0, 0, 0.0  # queue length, its max and time integral
+            self.b, self.ba = 0, 0.0     # customers in service and its time integral
+            self.ca = 0.0                # time integral of servers (shifts)
+            self.w, self.s = Stat(), Stat()  # waiting and sojourn (cycle time for sinks)
+            self.ser = None              # optional Series of queue lengths or cycle times
+            self.wq, self.sq, self.sh = Sketch(), Sketch(), Hist()  # quantiles and histogram
+      def _upd(self,t):
+            self.qa += self.q*(t-self.t)
+            self.ba += self.b*(t-self.t)
+            self.ca += self.c*(t-self.t)
+            self.t = t
+      def servers(self,t,c):  # number of servers changed
+            self._upd(t)
+            self.c = c
+      def queue(self,t,q):    # queue length changed
+            self._upd(t)
+            self.q = q
+            if q>self.qmax: self.qmax = q
+            if self.ser: self.ser.hold(t,q)
+      def begin(self,t,w):    # service begins after waiting w
+            self._upd(t)
+            self.b += 1
+            self.w.add(w)
+            self.wq.add(w)
+      def end(self,t,s):      # service ends after sojourn s
+            self._upd(t)
+            self.b -= 1
+            self.n += 1
+            self.s.add(s)
+            self.sq.add(s)
+            self.sh.add(s)
+      def sink(self,t,c):     # customer left the system after cycle time c
+            self.n += 1
+            self.s.add(c)
+            self.sq.add(c)
+            self.sh.add(c)
+            if self.ser: self.ser.add(c)
+      def merge(self,o):      # statistics of other server or replication
+            self.n, self.c, self.qmax, self.t = self.n+o.n, self.c+o.c, max(self.qmax,o.qmax), max(self.t,o.t)
+            self.q, self.qa, self.b, self.ba = self.q+o.q, self.qa+o.qa, self.b+o.b, self.ba+o.ba
+            self.ca += o.ca
+            self.w.merge(o.w)
+            self.s.merge(o.s)
+            self.wq.merge(o.wq)
+            self.sq.merge(o.sq)
+            self.sh.merge(o.sh)
+            return self
+      def report(self,T):     # statistics at time T
+            self._upd(max(T,self.t))
+            T = T>0 and T or 1.0
+            w95 = self.wq.quantiles([0.95])[0]
+            s50,s95,s99 = self.sq.quantiles([0.5,0.95,0.99])
+            return {"n":self.n,"u":self.ba/(self.ca or T*self.c or 1.0),"w":self.w.mean,"wsd":math.sqrt(self.w.var()),
+                    "s":self.s.mean,"ssd":math.sqrt(self.s.var()),"qmax":self.qmax,"q":self.qa/T,
+                    "w95":w95,"s50":s50,"s95":s95,"s99":s99}
 
 # ---- primitive classes ----
 class Customer():    # anonymous customer with a automatic name
@@ -67,19 +457,60 @@ class Customer():    # anonymous customer with a automatic name
             Customer.cnt += 1
             self.name = str(Customer.cnt)
             self.attr = {"cname":self.name} # Customer attributes
+            self.parent, self.n = None, 1  # token forked from, number of sibling tokens
+      def fork(self,n=1):  # token of a parallel branch (reads shared attributes, writes its own)
+            c = Customer.__new__(Customer)
+            c.name, c.parent, c.n, c.t0 = self.name, self, n, getattr(self,"t0",0.0)
+            c.attr = ChainMap({},self.attr)
+            return c
       def __str__(self):
             return str(self.name)
-class Queue():       # fifo of customers
-      def __init__(self):
-            self.objects = []
-      def push(self,obj):
-            self.objects.append(obj)
+class Queue():       # queue of customers: fifo, lifo or heap ordered by key (prio, spt, edf)
+      def __init__(self,disc="fifo"):
+            self.disc, self.n = disc, 0
+            self.objects = deque() if disc in ("fifo","lifo") else []
+      def push(self,obj,key=0):
+            if self.disc in ("fifo","lifo"):
+                  self.objects.append(obj)
+            else:             # the lowest key first, fifo within equal keys
+                  self.n += 1
+                  heapq.heappush(self.objects,(key,self.n,obj))
       def pop(self):
-            return self.objects.pop(0)
+            if self.disc=="fifo":
+                  return self.objects.popleft()
+            if self.disc=="lifo":
+                  return self.objects.pop()
+            return heapq.heappop(self.objects)[2]
+      def __iter__(self):
+            if self.disc in ("fifo","lifo"):
+                  return iter(self.objects)
+            return (o[2] for o in sorted(self.objects))
       def __len__(self):
             return len(self.objects)
       def __str__(self):
-            return str([str(o) for o in self.objects])
+            return str([str(o) for o in self])
+class Pool():        # resource pool kept in scenario variable (i.e. S.x) with FIFO of waiting
+      def __init__(self,var):
+            self.var, self.waiting, self.sim = var, deque(), None
+      def seize(self,e,cust,k,sim):  # grant at once or wait for release
+            self.sim = sim
+            if not self.waiting and BpmnEvent.S.get(self.var,0)>=k:
+                  BpmnEvent.S[self.var] -= k
+                  e._grant(cust,sim)
+            else:
+                  self.waiting.append((e,cust,k))
+                  e.nw += 1
+                  e.st.queue(sim.now(),e.nw)
+      def release(self):      # called when the variable is assigned
+            if self.waiting and self.sim!=None:
+                  self.sim.wakes.append(self)
+      def wake(self,sim):     # O(1) hand-off to the first waiting
+            while self.waiting and BpmnEvent.S.get(self.var,0)>=self.waiting[0][2]:
+                  e,cust,k = self.waiting.popleft()
+                  BpmnEvent.S[self.var] -= k
+                  e.nw -= 1
+                  e.st.queue(sim.now(),e.nw)
+                  e._grant(cust,sim)
 class QueuedEvent(Event):
       instances=[]
       def __init__(self,name=None):
@@ -94,14 +525,21 @@ class QueuedEvent(Event):
             if self.customer!=None:
                   if len(self.output)>0 and isinstance(self,XorGate):  
                         idx = 1  # send to second output
-                        if self.customer.attr["value"] or len(self.output)<2:
+                        if len(self.output)<2 or self.customer.attr.get("value"):
                               idx=0 # send rather to first output
                         if len(self.output)>2:  # more than 2 outputs
                               idx=int(self.customer.attr["value"])
                         self.output[idx].insert(self.customer, sim)
-                  else:
-                        for i in range(len(self.output)):  # split to all
-                              self.output[i].insert(self.customer, sim)
+                  elif len(self.output)>1 and isinstance(self,OrGate):  # activated outputs only
+                        v = self.customer.attr.get("value")
+                        idx = [i for i in range(len(self.output)) if isinstance(v,list) and i<len(v) and v[i]] or [0]
+                        for i in idx:
+                              self.output[i].insert(self.customer.fork(len(idx)), sim)
+                  elif len(self.output)>1:
+                        for i in range(len(self.output)):  # split to all (own tokens)
+                              self.output[i].insert(self.customer.fork(), sim)
+                  elif len(self.output)==1:
+                        self.output[0].insert(self.customer, sim)
       def prev(self):
             ep=[]
             for e0 in QueuedEvent.instances:
@@ -110,78 +548,287 @@ class QueuedEvent(Event):
                               ep.append(e0)
             return ep
 
+# ---- model language (parsed and validated once, compiled expressions in a restricted namespace) ----
+class ModelError(ValueError):  # invalid model (line - number of model line, 0 if unknown)
+      def __init__(self,msg,line=0):
+            ValueError.__init__(self,line and "line %d: %s"%(line,msg) or msg)
+            self.line = line
+_AST = (ast.Expression,ast.BoolOp,ast.BinOp,ast.UnaryOp,ast.IfExp,ast.Compare,ast.Call,ast.keyword,ast.Attribute,
+        ast.Subscript,ast.Slice,ast.Name,ast.Constant,ast.List,ast.Tuple,ast.Dict,ast.Set,ast.ListComp,ast.SetComp,
+        ast.DictComp,ast.GeneratorExp,ast.comprehension,ast.JoinedStr,ast.FormattedValue,ast.Starred,
+        ast.expr_context,ast.boolop,ast.operator,ast.unaryop,ast.cmpop)  # allowed syntax
+_FUNS = set("E U N B C T Emp Rate Shift fit tq math abs min max round int float bool str len sum sorted range list "
+            "dict tuple set any all zip enumerate divmod pow print".split())
+TRUSTED = False        # models of the host itself (command line): print to stdout and load data files by Emp, fit
+_OUT = []              # print of untrusted models (returned by simulate as "out")
+_NODES = set("Start Task XorGate AndGate OrGate Timer End Throw Terminate Script Condition Seize Release".split())
+_NS = {}               # namespace of expressions: whitelisted names only
+_CODE = {}             # compiled expressions and scripts by source text
+_MODELS = {}           # parsed and validated models by text (and TRUSTED)
+class _Vars():         # S.x and A.x variables in expressions
+      def __init__(self,d,p):
+            self.d,self.p = d,p
+      def __getattr__(self,k):
+            d = BpmnEvent.S if self.d is None else self.d
+            if self.p+k not in d: raise AttributeError(self.p+k)
+            return d[self.p+k]
+def _funs():           # names of functions allowed in models
+      return _FUNS
+def _out(*a,sep=" ",end="\n"):  # print of untrusted models: to the output of the run (1 MB at most)
+      if sum(map(len,_OUT))<1<<20: _OUT.append(str(sep).join(map(str,a))+str(end))
+def _names():
+      if not _NS or (_NS["print"] is print)!=TRUSTED:
+            import builtins
+            g = globals()
+            _NS.clear()
+            _NS.update({k:g[k] if k in g else getattr(builtins,k) for k in _funs()|_NODES})
+            _NS.update({"__builtins__":{},"S":_Vars(None,"S."),"A":None,"self":None,"ne":None,"print":print if TRUSTED else _out})
+      return _NS
+def _expr(src):        # code object and free names of a whitelisted expression
+      c = _CODE.get(src if not TRUSTED else (src,1))  # checks depend on TRUSTED
+      if c: return c
+      try:
+            t = ast.parse(src.strip(),mode="eval")
+      except SyntaxError as x:
+            raise ModelError("syntax error in %r: %s"%(src,x.msg))
+      bound = set()
+      for n in ast.walk(t):
+            if not isinstance(n,_AST):
+                  raise ModelError("%s not allowed in %r"%(n.__class__.__name__,src))
+            if isinstance(n,ast.Attribute) and (n.attr.startswith(("_","gi_","cr_","ag_","f_","co_","tb_")) or n.attr in ("format","format_map","mro")) or isinstance(n,ast.Name) and n.id[:2]==n.id[-2:]=="__":
+                  raise ModelError("%r not allowed in %r"%(getattr(n,"attr",None) or n.id,src))  # no way to frames, globals or str.format
+            if isinstance(n,ast.Call) and isinstance(n.func,ast.Name) and n.func.id in ("Emp","fit") and not TRUSTED \
+                  and not (n.args and isinstance(n.args[0],ast.List)):
+                  raise ModelError("%s takes a list of values in %r"%(n.func.id,src))  # data files only for trusted hosts
+            if isinstance(n,ast.comprehension):
+                  bound |= {m.id for m in ast.walk(n.target) if isinstance(m,ast.Name)}
+      names = {n.id for n in ast.walk(t) if isinstance(n,ast.Name)}-bound
+      names |= {n.value.id+"."+n.attr for n in ast.walk(t) if isinstance(n,ast.Attribute) and isinstance(n.value,ast.Name) and n.value.id in ("S","A")}
+      if len(_CODE)>4096: _CODE.clear()
+      c = _CODE[src if not TRUSTED else (src,1)] = (compile(t,"<model>","eval"),names)
+      return c
+def _prog(code):       # script "[target]=expression;..." as [(target,code object,names),...]
+      c = _CODE.get((code,TRUSTED))
+      if c: return c
+      import tokenize,io
+      ll = code.splitlines(True) or [""]
+      o = [0]
+      for l in ll: o.append(o[-1]+len(l))
+      parts,a,d,eq = [],0,0,None
+      try:
+            for t in tokenize.generate_tokens(io.StringIO(code).readline):
+                  if t.type!=tokenize.OP: continue
+                  i = o[t.start[0]-1]+t.start[1]
+                  if t.string in ("(","[","{"): d += 1
+                  elif t.string in (")","]","}"): d -= 1
+                  elif d==0 and t.string==";": parts,a,eq = parts+[(a,eq,i)],i+1,None
+                  elif d==0 and t.string=="=" and eq is None: eq = i
+      except (tokenize.TokenError,SyntaxError):
+            raise ModelError("unbalanced script %r"%code)
+      p = []
+      for a,eq,b in parts+[(a,eq,len(code))]:
+            if not code[a:b].strip(): continue
+            k = "dummy" if eq is None else code[a:eq].strip() or "value"
+            if not re.match(r"^([SA]\.)?[A-Za-z_]\w*$",k):
+                  raise ModelError("bad target %r in %r"%(k,code))
+            p.append((k,)+_expr(code[a if eq is None else eq+1:b]))
+      _CODE[(code,TRUSTED)] = p
+      return p
+def _model(s,k0=0,defs=None):  # parsed model: nodes [(line,id,pp2,definition,title,code object)], edges [(line,ylevel,i,j)], model nodes, exit
+      import tokenize,io
+      nodes, edges, ylevel, subs, defs, body = [], [], -1, [], dict(defs or {}), None
+      for k,s0 in enumerate(s.split('\n'),k0):
+            s1 = s0.strip()
+            m = re.match(r"^(?:def\s+([A-Za-z_]\w*)|(end))\s*(?:#.*)?$",s1)  # sub-process definition
+            if body is not None:
+                  if m and m.group(2):
+                        defs[name] = _model("\n".join(body),kd+1,defs)  # compiled once for all instances
+                        if not defs[name][0]: raise ModelError("empty sub-process %r"%name,kd+1)
+                        body = None
+                  elif m: raise ModelError("nested def %r"%m.group(1),k+1)
+                  else: body.append(s0)
+                  continue
+            if m:
+                  if m.group(2) or m.group(1) in _NODES|_FUNS: raise ModelError("unexpected %r"%s1,k+1)
+                  name,kd,body = m.group(1),k,[]
+                  continue
+            if len(s1)<2 or s1[0]=='#': continue
+            if re.match(r"^\d+\s*->",s1): # connection definition
+                  ylevel += 1   # used for marking required y position
+                  for s1a in s1.split("#")[0].split(";"):
+                        if not s1a.strip(): continue
+                        ij = s1a.split("->")
+                        if not all(re.match(r"^\s*\d+\s*$",x) for x in ij) or len(ij)<2:
+                              raise ModelError("bad edge %r"%s1a.strip(),k+1)
+                        edges += [(k+1,ylevel,int(ij[m])-1,int(ij[m+1])-1) for m in range(len(ij)-1)]
+                  continue
+            m = re.match(r"^(\d+(?:\.\d+)?)((?:/-?[\d.]+){0,2})\s+(\S.*)$",s1)
+            if not m:
+                  raise ModelError("not a node or connection: %r"%s1,k+1)
+            code,title = m.group(3),''
+            try:
+                  for t in tokenize.generate_tokens(io.StringIO(code).readline) if "#" in code else ():
+                        if t.type==tokenize.COMMENT:
+                              code,title = code[:t.start[1]],t.string[1:].split('#')[0].strip()
+                              break
+            except (tokenize.TokenError,SyntaxError):
+                  raise ModelError("unbalanced definition %r"%code,k+1)
+            cc = m.group(2).split("/")  # check identifier field
+            try:
+                  t = ast.parse(code.strip(),mode="eval")
+                  pp2 = [float(cc[1])-1 if len(cc)>1 else -1, float(cc[2])-1 if len(cc)>2 else -1]
+            except (SyntaxError,ValueError) as x:
+                  raise ModelError("bad definition %r"%code.strip(),k+1)
+            f = isinstance(t.body,ast.Call) and isinstance(t.body.func,ast.Name) and t.body.func.id
+            if f in defs:     # instance of sub-process
+                  if t.body.args or t.body.keywords: raise ModelError("sub-process %r takes no arguments"%f,k+1)
+                  subs.append((len(nodes),defs[f]))
+                  nodes.append((k+1,float(m.group(1)),pp2,None,title,None))
+                  continue
+            if f not in _NODES:
+                  raise ModelError("unknown element %r"%code.strip(),k+1)
+            try:
+                  c,names = _expr(code)
+            except ModelError as x:
+                  raise ModelError(str(x),k+1)
+            if names-_funs()-_NODES:
+                  raise ModelError("unknown name %r"%sorted(names-_funs()-_NODES)[0],k+1)
+            nodes.append((k+1,float(m.group(1)),pp2,code.strip(),title,c))
+      if body is not None:
+            raise ModelError("def %r without end"%name,kd+1)
+      n0 = len(nodes)
+      for k,y,i,j in edges:
+            if not (0<=i<n0 and 0<=j<n0):
+                  raise ModelError("edge %d->%d to unknown node"%(i+1,j+1),k)
+      out = list(range(n0))   # exit node of each model node (first node of sub-process is its entry, last one its exit)
+      for i,(dn,de,_,dx) in subs:
+            b = len(nodes)-1
+            g = lambda j: i if j==0 else b+j
+            l,id2,pp2,_,title,_ = nodes[i]
+            nodes[i] = (l,id2,pp2,dn[0][3],title or dn[0][4],dn[0][5])
+            for j,(l,id2,_,src,title,c) in enumerate(dn[1:],1):
+                  h = id2!=int(id2) and int(str(id2).split('.')[1])  # host of boundary event
+                  nodes.append((l,float("%d.%d"%(b+j+1,g(h-1)+1)) if h else float(b+j+1),[-1,-1],src,title,c))
+            edges += [(l,None,g(a),g(a2)) for l,y,a,a2 in de]
+            out[i] = g(dx)
+      edges = [(k,y,out[i],j) if y is not None and i<n0 else (k,y,i,j) for k,y,i,j in edges]
+      return nodes,edges,n0,out[-1] if out else 0
+def _check(ee,lines):  # unknown identifiers of node scripts and missing End
+      known,used = {"value","cname","dummy","self","ne","S","A","A.n"}|_funs(),[]
+      for e,l in zip(ee,lines):
+            try:
+                  p = _prog(e.code) if isinstance(e.code,str) else []
+                  nn = set().union(*[n for k,c,n in p])
+                  for x in (e.param if isinstance(e.param,list) else [e.param])+[getattr(e,"qkey","")]:
+                        if isinstance(x,str) and x: nn |= _expr(x)[1]
+            except ModelError as x:
+                  raise ModelError(str(x),l)
+            known |= {k for k,c,n in p}
+            used.append((l,nn))
+      for l,nn in used:
+            bad = sorted(n for n in nn-known if not re.match(r"^__t\d+[abe]$",n))
+            if bad:
+                  raise ModelError("unknown name %r"%bad[0],l)
+      if not any(isinstance(e,Sink) for e in ee):
+            raise ModelError("no End event")
+
 # ---- basic model classes (QueueEvent derived) ----
 class BpmnEvent(QueuedEvent):
       S = {}
+      P = {}     # resource pools by variable name
       def __init__(self,name=None,code=None):
             QueuedEvent.__init__(self,name)
             self.fun,self.param,self.code = None,None,code
             self.A,self.pp,self.pp2,self.title = {"A.n":0},[-1,0],[-1,-1],''
+            self.rs = {}              # own random streams
+            self.st = NodeStat()      # own statistics
+      def stream(self,what):          # random stream of the node for arrival, service or route
+            if RNG["seed"]==None:
+                  return random
+            if what not in self.rs:
+                  self.rs[what] = Stream("%s/%d/%s"%(RNG["seed"],self.id,what),RNG["anti"])
+            return self.rs[what]
       def _fun(self):
+            global _rng
+            _rng = self.stream(isinstance(self,Generator) and "arrival" or "service")
             p = self.param
             if isinstance(p,list):
-                  p = [float(eval(self.attr_replace(str(s)))) for s in p]
+                  p = [self._num(s) for s in p]
             else:
-                  p = float(eval(self.attr_replace(str(p))))
+                  p = self._num(p)
             #print("_fun:",self.fun,p,len(self.queue))
             return self.fun(p) if self.fun!=None else p
-      def attr_replace(self,cc):
-            if self.customer!=None:
-                  for k,v in self.customer.attr.items():
-                        cc = cc.replace(k,str(v))
-            for k,v in BpmnEvent.S.items():
-                  cc = cc.replace(k,str(v))
-            for k,v in self.A.items():
-                  cc = cc.replace(k,str(v))
-            return cc
-      def _eval(self,code,n=-1):
-            codes=self.code.split(";")
-            if n!=-1:
-                  codes=len(codes)>n and [codes[n]] or []
-            for code in codes:
-                  cc = code.split("=")
-                  cc[0] = cc[0].strip()
-                  if len(cc)==1:
-                        cc=["dummy"]+cc
-                  if len(cc)>1:
-                        cc[0] = len(cc[0])>0 and cc[0] or "value"
-                        cc[1] = self.attr_replace("=".join(cc[1:])) # rejoin
-                        try:
-                              ev=eval(cc[1])
-                              if cc[0].startswith("S."):
-                                    BpmnEvent.S[cc[0]]=ev
-                              elif cc[0].startswith("A."):
-                                    self.E[cc[0]]=ev
-                              else:
-                                    self.customer.attr[cc[0]]=ev
-                        except:
-                              self.customer.attr[cc[0]]=False
+      def _num(self,s):               # value of a parameter (number or expression)
+            return float(s) if isinstance(s,(int,float)) else float(self._value(_expr(str(s))[0]))
+      def _value(self,c):             # compiled expression for the node and its customer
+            g = _names()
+            g["self"],g["A"],g["ne"] = self,_Vars(self.A,"A."),globals().get("ne")
+            return eval(c,g,self.customer.attr if self.customer!=None else {})
+      def _eval(self,code,a=0,b=None):  # statements a..b-1 of script code
+            global _rng
+            _rng = self.stream("route")
+            for k,c,_ in _prog(code)[a:b]:
+                  try:
+                        ev=self._value(c)
+                        if k.startswith("S."):
+                              BpmnEvent.S[k]=ev
+                              if k in BpmnEvent.P:
+                                    BpmnEvent.P[k].release()
+                        elif k.startswith("A."):
+                              self.A[k]=ev
+                        else:
+                              self.customer.attr[k]=ev
+                  except ModelError:  # not allowed (i.e. data file of untrusted model)
+                        raise
+                  except Exception:
+                        if self.customer!=None: self.customer.attr[k]=False
 class ConditionalEvent(BpmnEvent):
       def __init__(self, code=None):
             BpmnEvent.__init__(self, None, code)
+            self.pool, self.k, self.nw = None, 1, 0  # resource pool variable, amount, waiting
+            m = code and re.match(r"^=\s*(S\.\w+)\s*(>\s*0|>=\s*(\d+))\s*;\s*\1\s*=\s*\1\s*-\s*(\d+)\s*$",code)
+            if m and int(m.group(4))==int(m.group(3) or 1): # "=S.x>0;S.x=S.x-1" seizes from pool S.x
+                  self.pool, self.k = m.group(1), int(m.group(4))
+      def _grant(self, cust, sim):    # resources seized - pass immediately
+            cust.attr["__t"+str(self.id)+"b"] = sim.now()
+            cust.attr["__t"+str(self.id)+"e"] = sim.now()
+            w = sim.now()-cust.attr["__t"+str(self.id)+"a"]
+            self.st.begin(sim.now(),w)
+            self.st.end(sim.now(),w)
+            self.customer = cust
+            self.out(sim)
+            self.customer = None
       def insert(self, cust, sim):
             cust.attr["__t"+str(self.id)+"a"] = sim.now()
             cust.attr["__t"+str(self.id)+"e"] = -1
-            if self.customer == None : # if free add to simulator conditions
-                  self.customer = cust
-                  self.customer.attr["value"]=False
-                  self.customer.attr["__t"+str(self.id)+"b"] = sim.now()
-                  sim.add_condition(self)
+            if self.pool!=None:        # no polling of conditions
+                  if self.pool not in BpmnEvent.P:
+                        BpmnEvent.P[self.pool] = Pool(self.pool)
+                  BpmnEvent.P[self.pool].seize(self,cust,self.k,sim)
+            elif self.customer == None : # if free add to simulator conditions
+                  self._wait(cust, sim)
             else:
-                  self.queue.push(cust)                                    
+                  self.queue.push(cust)
+                  self.st.queue(sim.now(),len(self.queue))
+      def _wait(self, cust, sim):     # first in queue waits for condition
+            self.customer = cust
+            self.customer.attr["value"]=False
+            self.customer.attr["__t"+str(self.id)+"b"] = sim.now()
+            self.st.begin(sim.now(),sim.now()-cust.attr["__t"+str(self.id)+"a"])
+            sim.add_condition(self)
       def exec(self, sim):
             b = False
             if self.code!=None:
-                  self._eval(self.code,0)
+                  self._eval(self.code,0,1)
                   if self.customer.attr["value"]==True:
-                        cc=self.code.split(';')
-                        if len(cc)>1:
-                              self._eval(";".join(cc[1:]))
+                        self._eval(self.code,1)
                         self.customer.attr["__t"+str(self.id)+"e"] = sim.now()
+                        self.st.end(sim.now(),sim.now()-self.customer.attr["__t"+str(self.id)+"a"])
                         self.out(sim)
                         self.customer = None    # mark that now the service is free !!!
                         if len(self.queue)>0 :  # but if anybody in queue
-                              self.insert(self.queue.pop(), sim)  # get and insert into simulator
+                              self._wait(self.queue.pop(), sim)  # get and insert into simulator
+                              self.st.queue(sim.now(),len(self.queue))
                         b = True  # ready to be removed from simulator conditions
             return b
 class Generator(BpmnEvent):
@@ -192,64 +839,135 @@ class Generator(BpmnEvent):
                   self._eval(self.code)   # evaluate script code ([var]=<value>)
       def exec(self, sim):
             self.customer = Customer()
+            self.customer.t0 = sim.now()  # birth time
+            self.st.n += 1
             self.customer.attr["__t"+str(self.id)+"a"] = sim.now()
             self.customer.attr["__t"+str(self.id)+"b"] = sim.now()
             self.customer.attr["__t"+str(self.id)+"e"] = sim.now()
             self.A["A.n"] += 1
             _print("Registering: " + str(self.customer) + " ("+str(self.time)+")")
             self.out(sim)             # pass customer to connected object
-            self.time += self._fun()
+            self.time = self.next(self.time)
             if self.tmax>0 and self.time <= self.tmax or self.n<-self.tmax-1:
                   self.n += 1
                   sim.add(self)       # next one in random time
+      def next(self,t):               # time of the next arrival
+            if isinstance(self.fun,Rate):   # non-homogeneous (time dependent rate)
+                  return self.fun.next(t,self.stream("arrival"))
+            return t+self._fun()
 class Service(BpmnEvent):
-      def __init__(self, fun, param, code=None): 
+      def __init__(self, fun, param, code=None, c=1, Q=None): 
             BpmnEvent.__init__(self,"Activity",code)  
             self.fun, self.param = fun, param 
             self.N = 1 # N number of tokens to wait (used for AndGate)
-      def insert(self, cust, sim):
+            self.wait = {} # tokens already joined by family (forking token)
+            self.c, self.busy, self.nb, self.sched = c, [], 0, False # servers, heap of (end,nb,customer)
+            self.st.c = c
+            disc,_,self.qkey = (Q or "fifo").partition(":")  # i.e. "lifo", "spt", "prio:cls", "edf:due"
+            if disc not in ("fifo","lifo","spt","prio","edf"):
+                  raise ModelError("unknown queue discipline %r (fifo, lifo, spt, prio:key, edf:key)"%Q)
+            if disc in ("prio","edf") and not self.qkey:
+                  raise ModelError("queue discipline %r needs a key, i.e. %r"%(Q,disc+":due"))
+            if disc in ("fifo","lifo") and self.qkey:
+                  raise ModelError("queue discipline %r takes no key"%Q)
+            self.queue = Queue(disc)
+      def _key(self,cust):    # key of a customer in the queue (the lowest served first)
+            if self.queue.disc in ("fifo","lifo"):
+                  return 0
+            c0,self.customer = self.customer,cust
+            if self.qkey:
+                  k = float(self._value(_expr(self.qkey)[0]))
+            elif self.queue.disc=="spt": # service time sampled in advance
+                  k = cust.attr["__s"+str(self.id)] = self._fun()
+            else:
+                  k = 0
+            self.customer = c0
+            return k
+      def insert(self, cust, sim, q=False):  # q - from own queue
             if isinstance(self,XorGate):
                   if len(self.output)>1 and self.code==None:
                         self.code="=B(0.5)"
-            if self.customer == None: # if free add to simulator with end time
-                  self.customer,t = cust,self._fun()
+            elif isinstance(self,OrGate):
+                  if len(self.output)>1 and self.code==None:  # first output only
+                        self.code="=["+",".join(["1"]+["0"]*(len(self.output)-1))+"]"
+            if len(self.busy)<self.c: # if any server free add to simulator with end time
+                  c0,self.customer = self.customer,cust
+                  t = cust.attr.pop("__s"+str(self.id),None)
+                  if t==None:
+                        t = self._fun()
                   if isinstance(t,list):  # [cycle,begin=0] cyclic timer (MM 1.11.2024)
                         if len(t)<2: t.append(0)
-                        self.time = t[1]+math.ceil((sim.now()-t[1])/t[0])*t[0]
-                        #_print("# "+str(self.customer)+": "+str(sim.now())+" "+str(self.time))
+                        te = t[1]+math.ceil((sim.now()-t[1])/t[0])*t[0]
                   else:
-                        self.time = sim.now() + t
+                        te = sim.now() + t
                   _print("#"+str(self.id)+" starts serving "+
-                         str(cust)+" ("+str(sim.now())+","+str(self.time)+")")
-                  self.customer.attr["__t"+str(self.id)+"b"]=sim.now()
-                  if "__n"+str(self.id) not in self.customer.attr:
-                        self.customer.attr["__n"+str(self.id)] = 0 # first time
-                  if "__t"+str(self.id)+"a" not in self.customer.attr:
+                         str(cust)+" ("+str(sim.now())+","+str(te)+")")
+                  cust.attr["__t"+str(self.id)+"b"]=sim.now()
+                  if not q:
                         cust.attr["__t"+str(self.id)+"a"]=sim.now() # if not from queue
+                  self.st.begin(sim.now(),sim.now()-cust.attr["__t"+str(self.id)+"a"])
                   if isinstance(self,Timer) and not isinstance(t,list):  # modify required final execution time
                         ta=cust.attr["__t"+str(self.id)+"a"]  
                         tb=cust.attr["__t"+str(self.id)+"b"]
                         cust.attr["__t"+str(self.id)+"b"] -= (tb-ta) # decrease begin time
-                        self.time -= (tb-ta)  # ... by the difference elapsed already
-                        #_print("# "+str(self.customer)+": "+str(self.time))
-                  sim.add(self)
+                        te -= (tb-ta)  # ... by the difference elapsed already
+                  self.nb += 1
+                  heapq.heappush(self.busy,(te,self.nb,cust))
+                  self.customer = c0
+                  self.time = self.busy[0][0]  # next completion of the station
+                  if not self.sched:
+                        self.sched = True
+                        sim.add(self)
             else:                     # else insert into queue
                   cust.attr["__t"+str(self.id)+"a"]=sim.now()  # with a queue adding timstamp
-                  self.queue.push(cust)
+                  self.queue.push(cust,self._key(cust))
+                  self.st.queue(sim.now(),len(self.queue))
       def exec(self, sim):
-            if self.customer!=None:
-                  self.customer.attr["__t"+str(self.id)+"e"]=sim.now()
-                  self.A["A.n"] += 1
+            self.sched = False
+            if not self.busy: return
+            self.customer = heapq.heappop(self.busy)[2]  # first completed
+            self.customer.attr["__t"+str(self.id)+"e"]=sim.now()
+            self.st.end(sim.now(),sim.now()-self.customer.attr["__t"+str(self.id)+"a"])
+            self.A["A.n"] += 1
             _print("#"+str(self.id)+" finished serving " + str(self.customer) + " at " + str(self.time))
             if self.code!=None :      
                   self._eval(self.code)   # evaluate script code ([var]=<value>)
-            if self.customer!=None:
-                  self.customer.attr["__n"+str(self.id)] += 1
-                  if (self.customer.attr["__n"+str(self.id)]%self.N) == 0: #self.N:
-                        self.out(sim)     # pass customer to connected object
-            self.customer = None    # mark that now the service is free !!!
+            N = self.N
+            if isinstance(self,OrGate) and len(self.output)<2 and self.nin()>1:
+                  N = self.customer.n   # only activated branches are joined
+            if N>1:                 # join N tokens of one family
+                  k = self.customer.parent or self.customer
+                  w = self.wait.setdefault(k,[])
+                  w.append(self.customer)
+                  if len(w)==N:
+                        del self.wait[k]
+                        if self.customer.parent!=None:  # continue with the forking token
+                              for c in w:  # the forking token itself waits too at unbalanced gateways
+                                    if c is not k and isinstance(c.attr,ChainMap):
+                                          k.attr.update(c.attr.maps[0])
+                              self.customer = k
+                        self.out(sim)
+            else:
+                  self.out(sim)     # pass customer to connected object
+            self.customer = None    # mark that now the server is free !!!
             if len(self.queue)>0 :  # but if anybody in queue
-                  Service.insert(self,self.queue.pop(), sim)  # get and insert into simulator
+                  Service.insert(self,self.queue.pop(), sim, True)  # get and insert into simulator
+                  self.st.queue(sim.now(),len(self.queue))
+            if self.busy:           # next completion
+                  self.time = self.busy[0][0]
+                  if not self.sched:
+                        self.sched = True
+                        sim.add(self)
+      def servers(self,c,sim):  # change of the number of servers (busy ones finish their customers)
+            self.c = c
+            self.st.servers(sim.now(),c)
+            while len(self.busy)<self.c and len(self.queue)>0:
+                  Service.insert(self,self.queue.pop(),sim,True)
+                  self.st.queue(sim.now(),len(self.queue))
+      def nin(self):          # number of unique inputs
+            if not hasattr(self,"_nin"):
+                  self._nin = len(set([e.id for e in self.prev()]))
+            return self._nin
 class Sink(BpmnEvent):
       def insert(self, cust, sim):    
             _print("Sinking "+str(cust)+" : "+str(sim.now()))
@@ -257,6 +975,7 @@ class Sink(BpmnEvent):
             cust.attr["__t"+str(self.id)+"b"] = sim.now()  # mark time in customer attributes
             cust.attr["__t"+str(self.id)+"e"] = sim.now()  # mark time in customer attributes
             self.A["A.n"] += 1
+            self.st.sink(sim.now(),sim.now()-getattr(cust,"t0",0.0))
             self.queue.push(cust)     # insert only to its queue 
 
 # ---- bpmn derived classes (from Generator, Service, ConditionalEvent or Sink) ----
@@ -269,27 +988,45 @@ class AndGate(Service):
             Service.__init__(self,None,0,code)
             self.setName("parallelGateway")
       def insert(self, cust, sim):
-            ids=[e.id for e in self.prev()] # ids of inputs
-            self.N=len(set(ids)) # set number of inputs (with unique ids) to wait
+            self.N = self.nin()  # number of tokens to wait
             Service.insert(self,cust,sim)
+class OrGate(Service):     # inclusive: outputs activated by vector i.e. "=[1,B(0.25)]"
+      def __init__(self,code=None):
+            Service.__init__(self,None,0,code)
+            self.setName("inclusiveGateway")
 class Start(Generator):
       def __init__(self,fun=E,param=[1],tnmax=50.0,code=None):
             Generator.__init__(self,fun,param,tnmax,code)
             self.setName("startEvent")
-class Task(Service):
-      def __init__(self,fun=U,param=[1,2],code=None,M=1):
-            Service.__init__(self,fun,param,code)
+class Task(Service):       # M servers sharing one queue (G/G/M station) with discipline Q
+      def __init__(self,fun=U,param=[1,2],code=None,M=1,Q=None):
+            self.shift = M if isinstance(M,Shift) else None  # or servers by calendar
+            Service.__init__(self,fun,param,code,self.shift.c0 if self.shift else M,Q)
             self.setName("task")
-            self.servers, self.nserver, self.M = [], 0, M
-            for i in range(self.M-1):
-                  Event.cnt -=1
-                  self.servers.append(Service(fun,param,code))
-      def insert(self, cust, sim):
-            if(self.nserver==0):  # myself
-                  Service.insert(self,cust,sim)
-            else:              # otherselfs
-                  self.servers[self.nserver-1].insert(cust,sim)
-            self.nserver = (self.nserver+1)%self.M
+            self.M = M
+class Shift():             # servers of a station by calendar [[time,servers],...] repeated every cycle
+      def __init__(self,cal=[[0,1]],cycle=0.0):
+            self.cal,self.cycle = sorted([float(t),int(c)] for t,c in cal),float(cycle)
+            self.c0 = self.cal[-1 if self.cycle>0 else 0][1]  # servers before the first change
+            self.station, self.i, self.k, self.time = None, 0, 0, 0.0
+      def start(self,station,sim):  # schedule the first change
+            self.station, self.i, self.k, self.time = station, 0, 0, self.cal[0][0]
+            sim.add(self)
+      def exec(self,sim):     # ordinary calendar event
+            if self.done(sim):  # calendars of all stations end with the process
+                  sim.events = [e for e in sim.events if not isinstance(e,Shift)]
+                  sim.time = sim.t0
+                  return
+            self.station.servers(self.cal[self.i][1],sim)
+            self.i += 1
+            if self.i==len(self.cal):
+                  if self.cycle<=0: return
+                  self.i,self.k = 0,self.k+1
+            self.time = self.k*self.cycle+self.cal[self.i][0]
+            sim.add(self)
+      def done(self,sim):     # nothing but calendars left and nobody waits at any station with a calendar
+            return all(isinstance(e,Shift) for e in sim.events) and \
+                   all(len(e.station.queue)==0 and not e.station.busy for e in sim.events+[self])
 class Timer(Service):
       def __init__(self,fun=1,param=None,code=None):
             if not callable(fun):  # when passing fixed delay value
@@ -316,20 +1053,35 @@ class Condition(ConditionalEvent):
       def __init__(self,code=None):
             ConditionalEvent.__init__(self,code)
             self.setName("intermediateCatchEvent")
+class Seize(Condition):    # waits for k resources of pool variable
+      def __init__(self,var="S.x",k=1):
+            Condition.__init__(self,"=%s>=%d;%s=%s-%d"%(var,k,var,var,k))
+class Release(Script):     # returns k resources to pool variable
+      def __init__(self,var="S.x",k=1):
+            Script.__init__(self,"%s=%s+%d"%(var,var,k))
 
 # ---- util2 --------      
 def connect(a, b):
       a.output.append(b)
-      if isinstance(a,Task):
-            for i in range(len(a.servers)):  # first server is already connected
-                  a.servers[i].output.append(b)
 def dict_tostring(a):
       return "\n".join([k+":\t"+str(v) for k,v in a.items()])
-def hist(a=[0,1], b=20, c='orange'):
-      import matplotlib.pyplot as plt
-      plt.hist(a,b,color=c)
-      plt.savefig("des_plot.svg", format="svg")
-      plt.show()
+def node_stat(e,T=0): # copy of node statistics at time T
+      e.st._upd(max(T,e.st.t))
+      return NodeStat(0).merge(e.st)
+def stats(ee,T):       # per node reports at time T
+      return [node_stat(e,T).report(T) for e in ee]
+def stats_tostring(ee,T):
+      s = "#id\tn\tu\tw\ts\ts95\tq\tqmax\n"
+      for e,r in zip(ee,stats(ee,T)):
+            s += "%d\t%d\t%.3f\t%.3f\t%.3f\t%.3f\t%.3f\t%d\n"%(e.id,r["n"],r["u"],r["w"],r["s"],r["s95"],r["q"],r["qmax"])
+      return s
+def hist(a=[0,1], b=20, c='orange'):  # streaming histogram saved as svg (no blocking plot)
+      h = Hist(2*b)
+      for x in a:
+            h.add(x)
+      s = h.to_svg(c)
+      print(s,file=open("des_plot.svg","w"))
+      return s
 def from_file(fname):
       with open(fname,"r") as fp:
             return fp.read()
@@ -360,12 +1112,12 @@ def attr_tosvgstring(o,wmax,w=16,h=24):
                   if w*t1>wmax[0]:
                         wmax[0] = w*t1
       return s
-def to_svg(ee=QueuedEvent.instances):
+def to_svg0(ee=QueuedEvent.instances):
       w,h,W,H = 16,24,[160],40  # W[0] for passing by reference!!!
       s = '<svg onclick="on_click()" xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n'
       for e in ee:
             if isinstance(e,End):
-                  for c in e.queue.objects:
+                  for c in e.queue:
                         s += attr_tosvgstring(c,W,w,h)
             H += 24
       H+=24
@@ -379,6 +1131,104 @@ def to_svg(ee=QueuedEvent.instances):
                   s+='<text x="'+str(20+w*i-8)+'" y="%d">'%(H)+str(i)+'</text>\n'
       s += "<script>function on_click() {[...document.getElementsByClassName('t1')].forEach(e=>e.style.display=(e.style.display=='none'?'':'none'));}</script>"
       return s%(W[0]+80,H+20) + '</svg>\n'
+def _visits(a):        # (node id, arrival, begin, end) of customer's own time stamps
+      for k in a:
+            if k[:3]=="__t" and k[-1]=="b" and k[3:-1].isdigit():
+                  yield int(k[3:-1]),a.get(k[:-1]+"a",a[k]),a[k],a.get(k[:-1]+"e",a[k])
+def to_svg(ee=QueuedEvent.instances,fp=None,ta=0.0,tb=None):  # Gantt chart streamed to fp (string if no fp) for window [ta,tb]
+      w,h,W,H = 16,24,160,40+24*len(ee)+24
+      c = ['hotpink','limegreen','cornflowerblue','coral','mediumseagreen','mediumpurple']
+      nodes = {e.id:e for e in ee}
+      sinks = [e for e in ee if isinstance(e,End)]
+      tb = math.inf if tb==None else tb
+      for e in sinks:         # pre-pass: width of the chart
+            for o in e.queue:
+                  for i,t0,t1,t2 in _visits(o.attr):
+                        if ta<=t1<=tb and w*(t1-ta)>W: W = w*(t1-ta)
+      if fp==None:
+            import io
+            f = io.StringIO()
+            to_svg(ee,f,ta,tb)
+            return f.getvalue()
+      fp.write('<svg onclick="on_click()" xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n'%(W+80,H+20))
+      for i,e in sorted(nodes.items()):  # row labels
+            fp.write('<text x="8" y="%d">%d<title>%s %s</title></text>\n'%(32+h*i,i,e.name,e.title))
+            fp.write('<text class="t1" style="display:none;fill:gray" x="32" y="%d">%s<title>%s</title></text>\n'%(32+h*i,e.title,e.name))
+      for e in sinks:
+            for o in e.queue:
+                  a = o.attr
+                  cn = a["cname"]
+                  for i,t0,t1,t2 in _visits(a):
+                        if t2<ta or t1>tb: continue
+                        s = '<rect y="'+str(20+h*i)+'" x="'+str(20+w*(t1-ta))
+                        s += '" width="'+str(t2-t1==0 and 1 or w*(t2-t1))+'" height="'+str(h-2)+'" stroke="black" fill-opacity="0.7" fill="'
+                        s += c[int(cn.split(' ')[0])%len(c)]+'"><title>'+cn+' ['+("%.2f, "%t0)+("%.2f, "%t1)+("%.2f"%t2)+']'+'</title></rect>\n'
+                        if t2-t1>0.5:
+                              s += '<text x="'+str(20+w*(t1-ta)+2)+'" y="'+str(20+h*i+18)+'">'+cn+'</text>'
+                        fp.write(s)
+      fp.write('<rect x="20" y="10" width="%d" height="2"/>\n'%(W+w))
+      fp.write('<rect x="20" y="%d" width="%d" height="2"/>\n'%(H+10,W+w))
+      for i in range(int(W/w+2)):
+            fp.write('<rect x="'+str(20+w*i)+'" y="10" width="1" height="10"/>\n')
+            fp.write('<rect x="'+str(20+w*i)+'" y="%d" width="1" height="10"/>\n'%(H))
+            if (i%10)==0:
+                  fp.write('<text x="'+str(20+w*i-8)+'" y="32">'+"%g"%(ta+i)+'</text>\n')
+                  fp.write('<text x="'+str(20+w*i-8)+'" y="%d">'%(H)+"%g"%(ta+i)+'</text>\n')
+      fp.write("<script>function on_click() {[...document.getElementsByClassName('t1')].forEach(e=>e.style.display=(e.style.display=='none'?'':'none'));}</script>")
+      fp.write('</svg>\n')
+def to_heat(ee=QueuedEvent.instances,T=None,nb=200,W=800):  # occupancy, queue and utilization of nodes binned over time
+      nodes = sorted(ee,key=lambda e:e.id)
+      row = {e.id:k for k,e in enumerate(nodes)}
+      sinks = [e for e in ee if isinstance(e,End)]
+      if T==None:
+            T = max([t2 for e in sinks for o in e.queue for i,t0,t1,t2 in _visits(o.attr)]+[1e-9])
+      bw = 10**math.floor(math.log10(T/nb))  # automatic bin width: 1, 2 or 5 times power of 10
+      bw = min([x*bw for x in (1,2,5,10) if x*bw*nb>=T])
+      n = int(math.ceil(T/bw)) or 1
+      q,b = [[0.0]*n for e in nodes],[[0.0]*n for e in nodes]  # time integrals in bins
+      def add(hh,t0,t1):
+            j = int(t0/bw)
+            while t0<t1 and j<n:
+                  te = min(t1,(j+1)*bw)
+                  hh[j] += te-t0
+                  t0,j = te,j+1
+      for e in sinks:         # one pass over the visits
+            for o in e.queue:
+                  for i,t0,t1,t2 in _visits(o.attr):
+                        if i in row:
+                              add(q[row[i]],t0,t1)
+                              add(b[row[i]],t1,t2)
+      cc = [max([c for c,t in getattr(e,"shift",None) and e.shift.cal or []]+[getattr(e,"c",1) or 1]) for e in nodes]
+      panels = [("occupancy",[[(q[k][j]+b[k][j])/bw for j in range(n)] for k in range(len(nodes))],"crimson"),
+                ("queue",[[q[k][j]/bw for j in range(n)] for k in range(len(nodes))],"darkorange"),
+                ("utilization",[[b[k][j]/bw/cc[k] for j in range(n)] for k in range(len(nodes))],"royalblue")]
+      h,cw,y = 14,W/n,20
+      s = ''
+      for name,vv,col in panels:
+            m = 1.0 if name=="utilization" else max([max(v) for v in vv]+[1e-9])
+            s += '<text x="4" y="%d" font-weight="bold">%s (max %.3g)</text>\n'%(y+12,name,m)
+            y += 18
+            for k,e in enumerate(nodes):
+                  s += '<text x="4" y="%d" font-size="11">%d<title>%s %s</title></text>\n'%(y+h*k+11,e.id,e.name,e.title)
+                  j = 0
+                  while j<n:    # runs of equal shade as one rectangle
+                        l = min(10,int(10*vv[k][j]/m+0.5))
+                        j1 = j+1
+                        while j1<n and min(10,int(10*vv[k][j1]/m+0.5))==l: j1 += 1
+                        if l>0:
+                              s += '<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s" fill-opacity="%.1f"><title>%g-%g: %.3g</title></rect>\n'%(
+                                    40+j*cw,y+h*k,(j1-j)*cw,h-1,col,l/10,j*bw,j1*bw,max(vv[k][j:j1]))
+                        j = j1
+            y += h*len(nodes)+6
+      for j in range(0,n+1,max(1,n//10)):  # time axis
+            s += '<rect x="%.1f" y="%d" width="1" height="6"/><text x="%.1f" y="%d" font-size="11">%g</text>\n'%(40+j*cw,y,40+j*cw-4,y+18,j*bw)
+      return '<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n'%(W+60,y+24)+s+'</svg>\n'
+def to_chart(ee=QueuedEvent.instances,fp=None,nmax=500):  # Gantt chart of few customers, otherwise heat map
+      if sum(len(e.queue) for e in ee if isinstance(e,End))<=nmax:
+            return to_svg(ee,fp)
+      s = to_heat(ee)
+      if fp==None: return s
+      fp.write(s)
 def to_dot0(ee=QueuedEvent.instances):
       s ='digraph BPMN { rankdir="LR" ranksep=1 nodesep=1\n'
       for i in range(len(ee)):
@@ -401,18 +1251,20 @@ def to_dot(ee=QueuedEvent.instances):
             elif "end" in ee[i].name: style="filled"; pen="3"
             if "exclusive" in ee[i].name: xlabel=label; label="X"
             elif "parallel" in ee[i].name: xlabel=label; label="+"
+            elif "inclusive" in ee[i].name: xlabel=label; label="O"
             s += '  '+ee[i].name +' [label="'+label+'" xlabel="'+xlabel
             s += '" style="'+style+'" shape="'+shape+'" fillcolor="'
             s += color+'" penwidth="'+pen+'" '+size+']' +'\n'
       for i in range(len(ee)):
-            s1 = '  {rank=same; '
             for j in range(len(ee[i].output)):
                   s += "  "+ee[i].name + " -> " + ee[i].output[j].name +"\n"
-                  s1 += ee[i].output[j].name +"; "
-            if len(ee[i].output)>1:
-                  if abs(ee[i].output[0].id-ee[i].output[1].id)<2: s += s1 +'}\n'
+      rr = {}
+      for e,p in zip(ee,layers(ee)):  # ranks of the layered layout (in order)
+            rr.setdefault(p[0],[]).append((p[1],e.name))
+      for r in sorted(rr):
+            if len(rr[r])>1: s += '  {rank=same; '+"; ".join(n for o,n in sorted(rr[r]))+'}\n'
       return s+'}'
-def to_position(ee=QueuedEvent.instances):
+def to_position0(ee=QueuedEvent.instances):
       pp=[]
       for i in range(len(ee)):   # set x position to tree level
             x,ep = 0,ee[i].prev()
@@ -456,6 +1308,103 @@ def to_position(ee=QueuedEvent.instances):
                   id2=int(str(e.id2).split(".")[1])
                   e.pp[0],e.pp[1] = ee[id2-1].pp[0],ee[id2-1].pp[1]
       return [e.pp for e in ee]
+_LAYOUT = {}          # layouts by graph structure
+def layers(ee,sweeps=4):  # layered (Sugiyama) layout: [layer,order] of nodes
+      n = len(ee)
+      k = {id(e):i for i,e in enumerate(ee)}
+      out = [[k[id(o)] for o in e.output if id(o) in k] for e in ee]
+      key = tuple(map(tuple,out))
+      if key in _LAYOUT:
+            return [list(p) for p in _LAYOUT[key]]
+      nin = [0]*n
+      for oo in out:
+            for j in oo: nin[j] += 1
+      d = [-1]*n              # bfs depth from the starts
+      for r in [i for i in range(n) if nin[i]==0]+list(range(n)):
+            if d[r]>=0: continue
+            d[r], q = 0 if nin[r]==0 else max(d)+1, deque([r])
+            while q:
+                  u = q.popleft()
+                  for v in out[u]:
+                        if d[v]<0:
+                              d[v] = d[u]+1
+                              q.append(v)
+      c, low, num, st, on, cnt = [-1]*n, [0]*n, [-1]*n, [], [False]*n, 0  # strongly connected components (Tarjan)
+      for r in range(n):
+            if num[r]>=0: continue
+            num[r] = low[r] = cnt; cnt += 1
+            st.append(r); on[r] = True
+            cs = [(r,iter(out[r]))]
+            while cs:
+                  u,it = cs[-1]
+                  for v in it:
+                        if num[v]<0:
+                              num[v] = low[v] = cnt; cnt += 1
+                              st.append(v); on[v] = True
+                              cs.append((v,iter(out[v])))
+                              break
+                        elif on[v]:
+                              low[u] = min(low[u],num[v])
+                  else:
+                        cs.pop()
+                        if cs: low[cs[-1][0]] = min(low[cs[-1][0]],low[u])
+                        if low[u]==num[u]:
+                              while True:
+                                    v = st.pop(); on[v] = False; c[v] = u
+                                    if v==u: break
+      back = set((u,v) for u in range(n) for v in out[u] if c[u]==c[v] and d[v]<=d[u])  # loop edges, i.e. 12->6
+      dag = [[v for v in out[u] if (u,v) not in back] for u in range(n)]
+      deg = [0]*n
+      for oo in dag:
+            for v in oo: deg[v] += 1
+      q, L = deque(i for i in range(n) if deg[i]==0), [0]*n   # longest path layering
+      while q:
+            u = q.popleft()
+            for v in dag[u]:
+                  L[v] = max(L[v],L[u]+1)
+                  deg[v] -= 1
+                  if deg[v]==0: q.append(v)
+      up, dn = [[] for i in range(n)], [[] for i in range(n)]  # edges between adjacent layers (dummies for long ones)
+      layer = [[] for i in range(max(L)+1 if n else 0)]
+      for u in range(n): layer[L[u]].append(u)
+      m = n
+      for u in range(n):
+            for v in dag[u]:
+                  a = u
+                  for l in range(L[u]+1,L[v]):
+                        up.append([]); dn.append([])
+                        layer[l].append(m)
+                        dn[a].append(m); up[m].append(a)
+                        a, m = m, m+1
+                  dn[a].append(v); up[v].append(a)
+      pos = [0.0]*m
+      for ll in layer:
+            for o,u in enumerate(ll): pos[u] = o
+      for sw in range(2*sweeps):  # barycentric crossing reduction, down and up sweeps
+            rr = range(1,len(layer)) if sw%2==0 else range(len(layer)-2,-1,-1)
+            nb = up if sw%2==0 else dn
+            for l in rr:
+                  ll = layer[l]
+                  b = {u:(sum(pos[w] for w in nb[u])/len(nb[u]) if nb[u] else pos[u]) for u in ll}
+                  ll.sort(key=lambda u:(b[u],pos[u]))
+                  for o,u in enumerate(ll): pos[u] = o
+      pp = [[L[u],int(pos[u])] for u in range(n)]
+      if len(_LAYOUT)>=256: _LAYOUT.pop(next(iter(_LAYOUT)))
+      _LAYOUT[key] = [tuple(p) for p in pp]
+      return pp
+def to_position(ee=QueuedEvent.instances):  # layered layout with forced positions and boundary events
+      pp = layers(ee)
+      for i in range(len(ee)):
+            ee[i].pp = pp[i]
+            if ee[i].pp2[0]!=-1:    # force position from pp2
+                  ee[i].pp[0]=ee[i].pp2[0]
+            if ee[i].pp2[1]!=-1:
+                  ee[i].pp[1]=ee[i].pp2[1]
+      for e in ee:   # correct position of boundary events
+            if(e.id!=e.id2):
+                  id2=int(str(e.id2).split(".")[1])
+                  e.pp[0],e.pp[1] = ee[id2-1].pp[0],ee[id2-1].pp[1]
+      return [e.pp for e in ee]
 def to_bpmn(ee=QueuedEvent.instances,pp=None):
       s ='<?xml version="1.0" encoding="UTF-8"?>\n'
       s+='<bpmn:definitions xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
@@ -482,6 +1431,8 @@ def to_bpmn(ee=QueuedEvent.instances,pp=None):
             ename = ee[i].__class__.__name__+'_'+str(ee[i].fun and ee[i].fun.__name__ or None)+'_'
             import base64
             ename += base64.b16encode(bytearray(str(ee[i].param)+'_'+str(ee[i].code),'ascii')).decode('ascii') # requires encoding!
+            if getattr(ee[i],"src",None):  # whole definition for importing back (from_bpmn)
+                  ename += '_'+base64.b16encode(ee[i].src.encode('utf-8')).decode('ascii')
             type=name.split("_")[0]
             gt={"wi":80,"h":60,"ox":0,"oy":0,"e":(80,30),"w":(0,30),"n":(40,0),"s":(40,60)}
             gg={"wi":36,"h":36,"ox":22,"oy":12,"e":(58,30),"w":(22,30),"n":(40,12),"s":(40,48)}
@@ -497,7 +1448,8 @@ def to_bpmn(ee=QueuedEvent.instances,pp=None):
                   xo,yo = ee[id2-1].x+22.5,ee[id2-1].y+42.5
                   type = "boundaryEvent"
             ee[i].x,ee[i].y = xo,yo
-            s1+='  <bpmn:'+type+' id="'+name+'" name="'+name.split("_")[1]+'\n'+ee[i].title+'">\n'
+            host = ' attachedToRef="'+ee[id2-1].name.replace("terminate","")+'"' if type=="boundaryEvent" else ''
+            s1+='  <bpmn:'+type+' id="'+name+'"'+host+' name="'+name.split("_")[1]+'\n'+ee[i].title+'">\n'
             s2+='   <bpmndi:BPMNShape id="'+name+'_'+ename+'" bpmnElement="'+name+'">\n'
             s2+='    <dc:Bounds x="'+str(xo)+'" y="'+str(yo)+'" width="'+str(w)+'" height="'+str(h)+'" />\n'
             s2+='   </bpmndi:BPMNShape>\n'
@@ -556,46 +1508,113 @@ def to_bpmn(ee=QueuedEvent.instances,pp=None):
       s1+=s1a+' </bpmn:process>\n'
       return s+s1+s2+'</bpmn:definitions>\n'
 
+def _bpmn_def(cls,fun,param,code):  # definition from class, function, param and code of a shape id
+      code = None if code=="None" else code
+      if fun not in ("E","U","N","B","C","T","None"): fun = None  # sampler objects need the whole definition
+      if cls=="Start":
+            return "Start(%s,%s,50.0,%r)"%(fun or "E",param if fun else [1],code)
+      if cls=="Task":
+            return "Task(%s,%s,%r)"%(fun or "U",param if fun else [1,2],code)
+      if cls=="Timer":
+            return "Timer(%s,%r)"%(param,code) if fun=="None" else "Timer(%s,%s,%r)"%(fun or 1,param if fun else None,code)
+      if cls in ("End","Terminate","Throw"):
+            return cls+"()"
+      cls = {"Seize":"Condition","Release":"Script"}.get(cls,cls)
+      return "%s(%r)"%(cls,code) if cls in ("XorGate","AndGate","OrGate","Script","Condition") else None
+def from_bpmn(src):    # model text of a bpmn file (name or file object) read in one pass
+      import xml.etree.ElementTree as ET, base64, io
+      if isinstance(src,str) and src.lstrip().startswith("<"): src = io.StringIO(src)
+      tasks = {"task":"Task()","userTask":"Task()","serviceTask":"Task()","manualTask":"Task()","sendTask":"Task()",
+               "receiveTask":"Task()","businessRuleTask":"Task()","callActivity":"Task()","subProcess":"Task()",
+               "scriptTask":"Script()","exclusiveGateway":"XorGate()","eventBasedGateway":"XorGate()",
+               "parallelGateway":"AndGate()","inclusiveGateway":"OrGate()","complexGateway":"OrGate()",
+               "startEvent":"Start()","endEvent":"End()","intermediateThrowEvent":"Throw()",
+               "intermediateCatchEvent":"Timer(1)","boundaryEvent":"Timer(1)"}
+      nodes, flows, shapes, sub = [], [], {}, 0  # nodes in document order, (source,target), id:(shape id,x,y), nesting
+      for ev,e in ET.iterparse(src,("start","end")):
+            tag = e.tag.rsplit("}",1)[-1]
+            tag = tag[0].lower()+tag[1:] if tag[1:2].islower() else tag  # also "EndEvent" of to_bpmn
+            if ev=="start":
+                  sub += tag=="subProcess"
+                  continue
+            if tag=="subProcess": sub -= 1
+            if sub: continue    # contents of sub-processes are not simulated
+            if tag in tasks:
+                  dd = [c.tag.rsplit("}",1)[-1] for c in e]
+                  d = tasks[tag]
+                  if "terminateEventDefinition" in dd: d = "Terminate()"
+                  if "conditionalEventDefinition" in dd: d = "Condition()"
+                  nodes.append((e.get("id"),d,e.get("name") or "",e.get("attachedToRef")))
+                  e.clear()
+            elif tag=="sequenceFlow":
+                  flows.append((e.get("sourceRef"),e.get("targetRef")))
+                  e.clear()
+            elif tag=="BPMNShape":
+                  b = [c for c in e if c.tag.endswith("Bounds")]
+                  shapes[e.get("bpmnElement")] = (e.get("id"),float(b[0].get("x")),float(b[0].get("y"))) if b else (e.get("id"),None,None)
+                  e.clear()
+      ids = {n[0]:i+1 for i,n in enumerate(nodes)}
+      s = ''
+      for name,d,title,host in nodes:
+            sid,x,y = shapes.get(name,("",None,None))
+            ee,pos = sid[len(name)+1:].split("_") if sid.startswith(name+"_") else [],''
+            try:
+                  if len(ee)>3:     # whole definition
+                        d = base64.b16decode(ee[3]).decode('utf-8')
+                  elif len(ee)>2:   # class, function, param and code
+                        param,_,code = base64.b16decode(ee[2]).decode('utf-8').partition("_")
+                        d = _bpmn_def(ee[0],ee[1],param,code) or d
+                  if len(ee)>2 and x is not None and not host:  # grid position of des layout
+                        g = (0,0) if "ask" in name.split("_")[0] else (22,12)
+                        pos = "/%g/%g"%(round((x-g[0]-40)/100,2)+1,round((y-g[1]-30)/100,2)+1)
+            except ValueError:  # not des encoded
+                  pass
+            id = str(ids[name])+("."+str(ids[host]) if host in ids else "")
+            num,title = name.rsplit("_",1)[-1]," ".join(title.split())
+            if title.split(" ")[0]==num: title = title[len(num):].strip()  # "id title" of to_bpmn
+            s += id+pos+" "+d+(" # "+title.replace("#","") if title else "")+"\n"
+      return s+";".join("%d->%d"%(ids[a],ids[b]) for a,b in flows if a in ids and b in ids)+"\n"
+
 class EventNetwork():
       def __init__(self,s):
             Event.cnt, Customer.cnt = 0, 0
             QueuedEvent.instances.clear()
-            BpmnEvent.S = {}
+            BpmnEvent.S, BpmnEvent.P = {}, {}
             self.ee = self.from_string(s)
             self.pp = to_position(self.ee)
       def __getitem__(self,i):
             return self.ee[i]
       def from_string(self,s):
-            ee, Event.cnt, ylevel = [], 0, -1
-            for s0 in s.split('\n'):
-                  s1 = s0.strip()
-                  if len(s1)<2 or s1[0]=='#': continue
-                  if "->" in s1: # connection definition
-                        ylevel += 1   # used for marking required y position
-                        for s1a in s1.split(";"):
-                                code = s1a.strip().split("->")
-                                if len(code)>1:
-                                        code[1]=code[1].split("#")[0]
-                                        i,j = int(code[0])-1, int(code[1])-1
-                                        if i>-1 and j>-1:
-                                              connect(ee[i],ee[j])
-                                        if i>-1 and ee[i].pp2[1]==-1: # if not set yet
-                                              ee[i].pp2[1]=ylevel # force y position
-                                        if j>-1 and ee[j].pp2[1]==-1: # if not set yet
-                                              ee[j].pp2[1]=ylevel # force y position                  
-                  else:          # event definition
-                        code=s1.split(" ")
-                        if len(code)>1:
-                                code1=" ".join(code[1:]).split('#')
-                                ee.append(eval(code1[0]))
-                                ee[-1].id2=float(code[0]) # id as written in source 
-                                ee[-1].title=code1[1].strip() if len(code1)>1 else ''
-                                cc=code[0].split("/")  # check identifier field
-                                ee[-1].pp2[0] = float(cc[1])-1 if len(cc)>1 else -1 
-                                ee[-1].pp2[1] = float(cc[2])-1 if len(cc)>2 else -1
-            if len(set([e.pp2[1] for e in ee]))==1: # verify if multi-line description
-                  for e in ee:      # if yes
+            m = _MODELS.get((s,TRUSTED)) or _model(s)
+            ee, Event.cnt = [], 0
+            for k,id2,pp2,src,title,c in m[0]:
+                  try:
+                        ee.append(eval(c,_names()))
+                  except ModelError as x:
+                        raise ModelError(str(x),k)
+                  except Exception as x:
+                        raise ModelError("%s: %s"%(x.__class__.__name__,x),k)
+                  ee[-1].id2 = id2  # id as written in source
+                  ee[-1].src, ee[-1].title = src, title  # definition as written (kept by to_bpmn)
+                  ee[-1].pp2 = pp2[:]
+            for k,y,i,j in m[1]:
+                  connect(ee[i],ee[j])
+                  if y is None: continue  # inside sub-process
+                  if ee[i].pp2[1]==-1: # if not set yet
+                        ee[i].pp2[1]=y   # force y position
+                  if ee[j].pp2[1]==-1: # if not set yet
+                        ee[j].pp2[1]=y   # force y position
+            nin = [set() for e in ee]  # unique inputs of nodes (joins) at once
+            for e in ee:
+                  for o in e.output: nin[o.id-1].add(e.id)
+            for e in ee: e._nin = len(nin[e.id-1])
+            if len(set([e.pp2[1] for e in ee[:m[2]]]))==1: # verify if multi-line description
+                  for e in ee[:m[2]]:  # if yes
                         e.pp2[1]=-1 # clear all y-levels to unknown
+            if (s,TRUSTED) not in _MODELS:  # validated once
+                  _check(ee,[n[0] for n in m[0]])
+                  if len(_MODELS)>=64: _MODELS.pop(next(iter(_MODELS)))
+                  _MODELS[s,TRUSTED] = m
             return ee
       def to_string(self):
             s=''
@@ -647,10 +1666,11 @@ def bpmn_tosvg0(bpmnfile,W=100,H=80):
 def bpmn_tosvg(bpmnfile,W=100,H=80):
       s = '<defs><marker id="triangle" viewBox="0 0 10 10" refX="10" refY="5" markerUnits="strokeWidth" markerWidth="10" markerHeight="10" orient="auto"> <path d="M 0 0 L 10 5 L 0 10 z" fill="black" /></marker></defs>\n'
       import xml.etree.ElementTree as ET
-      for e in ET.parse(bpmnfile).getroot():  # collect named processes
+      root = ET.parse(bpmnfile).getroot()  # file name or file object
+      for e in root:  # collect named processes
             if "process" in e.tag:
                   elems=[d for d in e if "name" in d.attrib]
-      for e in ET.parse(bpmnfile).getroot():  # collect diagram elements
+      for e in root:  # collect diagram elements
             if "BPMNDiagram" in e.tag:
                   for d in e:
                         items=[p for p in d if "BPMNPlane" in d.tag]
@@ -671,7 +1691,7 @@ def bpmn_tosvg(bpmnfile,W=100,H=80):
                         id=ids[1]
                         if len(ids)>4:
                               import base64
-                              ids[4]=base64.b16decode(ids[4],'ascii').decode('ascii')
+                              ids[4:]=[base64.b16decode(x).decode('utf-8') for x in ids[4:]]
                         id2="_".join(ids[2:]).replace('<','&lt;').replace('>','&gt;')
                         s+='<text x="'+str(x-6)+'" y="'+str(y+h+12)+'">'+id+'</text>\n'
                         s+='<text font-size="smaller" style="fill:gray" x="'+str(x-12)+'" y="'+str(y-6)+'"><tspan xml:space="preserve">'+name+'</tspan></text>\n'
@@ -705,6 +1725,8 @@ def bpmn_tosvg(bpmnfile,W=100,H=80):
                                     s+='<path d="M%g %g L%g %g M%g %g L%g %g" stroke="black" stroke-width="3" />\n'%(x+w/2-6,y+h/2-6,x+w/2+6,y+h/2+6,x+w/2+6,y+h/2-6,x+w/2-6,y+h/2+6)
                               elif "parallel" in it.attrib["id"]:
                                     s+='<path d="M%g %g L%g %g M%g %g L%g %g" stroke="black" stroke-width="3" />\n'%(x+w/2-8,y+h/2,x+w/2+8,y+h/2,x+w/2,y+h/2-8,x+w/2,y+h/2+8)
+                              elif "inclusive" in it.attrib["id"]:
+                                    s+='<circle cx="%g" cy="%g" r="%g" stroke="black" stroke-width="3" fill="none" />\n'%(x+w/2,y+h/2,w/4)
                         else:
                               s+= '<rect rx="7" ry="7" x="'+str(x)+'" y="'+str(y)+'" width="'+str(w)+'" height="'+str(h)+'" stroke="darkblue" fill="white"><title>'+id2+'</title></rect>\n'
                               if "script" in it.attrib["id"]:
@@ -716,7 +1738,7 @@ def bpmn_tosvg(bpmnfile,W=100,H=80):
       s += "<script>function on_click() {[...document.getElementsByClassName('t1')].forEach(e=>e.style.display=(e.style.display=='none'?'':'none'));}</script>"
       s = '<svg onclick="on_click()" xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">\n'%(W+40,H+30)+s
       return s + to_anim() + '</svg>\n'
-def to_anim():
+def to_anim0():
       #return s
       global ne
       s =  '<defs><filter x="0" y="0" width="1" height="1" id="fi">\n'
@@ -724,7 +1746,7 @@ def to_anim():
       s += '<feComposite in="SourceGraphic" operator="atop"/></filter></defs>\n'
       for e in ne.ee:
             if isinstance(e,End):
-                  for c in e.queue.objects:
+                  for c in e.queue:
                         for i in range(len(ne.ee)):
                               x, y, a = ne.ee[i].x, ne.ee[i].y, c.attr 
                               s +='<text class="t1" filter="url(#fi)" style="font-size:small;fill:red" x="'+str(x-16)+'" y="'+str(y+13)+'" visibility="hidden">'+str(c.name)+'\n'
@@ -741,6 +1763,45 @@ def to_anim():
                               s +='</text>\n'
       return s
 
+_PLAYER = """(function(){var ss=document.getElementsByTagName("script"),me=document.currentScript||ss[ss.length-1],g=me.parentNode,d=JSON.parse(me.previousElementSibling.textContent),
+ev=[],t=0,i=0,t0=null,ns="http://www.w3.org/2000/svg";
+d.c.forEach(function(c){var a=t+=c[1],k;for(k=2;k<c.length;k+=4){a+=c[k+1];var b=a+c[k+2],e=b+c[k+3],o={n:c[0],p:d.p[c[k]]};
+ev.push([a,0,o],[b,1,o],[e,2,o]);}});
+ev.sort(function(x,y){return x[0]-y[0]||x[1]-y[1];});
+function f(now){if(t0===null)t0=now;var s=(now-t0)*d.u;
+for(;i<ev.length&&ev[i][0]<=s;i++){var o=ev[i][2];
+if(ev[i][1]==0){o.el=document.createElementNS(ns,"text");o.el.setAttribute("x",o.p[0]-16);o.el.setAttribute("y",o.p[1]+13);
+o.el.setAttribute("filter","url(#fi)");o.el.textContent=o.n;o.el.style.transition="transform 0.5s";g.appendChild(o.el);}
+else if(ev[i][1]==1){o.el.style.transform="translate(54px,0)";}
+else{o.el.remove();}}
+if(i<ev.length)requestAnimationFrame(f);}
+requestAnimationFrame(f);})();"""
+def to_anim(ee=None,u=1.0):  # tokens played by one script from a compact delta encoded timeline (u - time units per second)
+      import json
+      ee = ee or ne.ee
+      p = {e.id:[round(e.x),round(e.y)] for e in ee if hasattr(e,"x")}
+      cc = []
+      for e in ee:
+            if isinstance(e,End):
+                  for c in e.queue:
+                        vv = sorted([(round(1000*t0),round(1000*t1),round(1000*t2),i) for i,t0,t1,t2 in _visits(c.attr) if i in p])
+                        if vv: cc.append((vv[0][0],str(c.name),vv))
+      cc.sort()
+      tl,t = [],0
+      for t0,name,vv in cc:   # [name, start delta, (node, arrival delta, wait, service)...] in ms
+            c,a = [name,t0-t],t0
+            for ta,tb,te,i in vv:
+                  c += [i,ta-a,tb-ta,te-tb]
+                  a = ta
+            tl.append(c)
+            t = t0
+      d = json.dumps({"u":u,"p":p,"c":tl},separators=(",",":")).replace("<","\\u003c").replace("&","\\u0026")
+      s =  '<defs><filter x="0" y="0" width="1" height="1" id="fi">\n'
+      s += '<feFlood flood-color="white"/>\n'
+      s += '<feComposite in="SourceGraphic" operator="atop"/></filter></defs>\n'
+      s += '<g class="t1" style="font-size:small;fill:red"><script type="application/json">'+d+'</script>\n'
+      return s + '<script><![CDATA['+_PLAYER+']]></script></g>\n'
+
 # ----- demo examples ------
 # event list must be in order
 # connections could be semicolon separated in one line
@@ -1188,7 +2249,7 @@ ex29="""
 5 Task()
 6 AndGate()
 7 XorGate()
-8 Script("import sys;sys.out.write(cname)") # # self.customer.attr
+8 Script("print(cname)") # # self.customer.attr
 9 End()
 1->2; 2->3;              3->7; 7->8;
       2->4;       4->6;  6->7;
@@ -1203,19 +2264,285 @@ ex30="""
 1->2; 2->3;
       2->5
 """
+ex31="""
+# OrGate test
+1 Start(E,[2.0],-20.0,"S.v1=[]")  #E(2)t20 # 20 units of exponential events with mean of 2 time units
+2 OrGate("=[1,B(0.25)]") #1-always
+3 XorGate()
+4 Task(U,[1.0,3.0]) #U(1,3)
+5 Task(U,[3.0,4.0]) #U(3,4)
+6/4 Task(U,[2.0,3.0],"S.v1=S.v1+[cname];S.v2=len(S.v1)") #U(2,3)  # collecting its customers in S.v1
+7 XorGate()  #  # collecting its customers in S.v2
+8 OrGate()
+9 End()
+1->2; 2->3; 3->4; 4->7; 7->8; 8->9;
+            3->5; 5->7;
+      2->6;             6->8;
+"""
+ex32="""
+# Triage - urgent patients (cls=0) are served first
+1 Start(E,[1.0],-200.0)
+2 Script("cls=C([0.2,0.8])")          # 20% urgent
+3 Task(E,[1.8],None,2,"prio:cls")     # two doctors, priority queue
+4 End()
+1->2; 2->3; 3->4
+"""
+ex33="""
+# Daily profile - arrivals per hour: night 0.5, morning peak 6, afternoon 3, evening 1
+1 Start(Rate([0,7,11,17,21],[0.5,6,3,1,0.5],24),None,72.0)
+2 Task(E,[0.4],None,3)
+3 End()
+1->2; 2->3
+"""
+ex34="""
+# Measured durations - empirical service times and discrete batch routing
+1 Start(E,[2.0],-200.0)
+2 Task(Emp([0.9,1.1,1.2,1.3,1.3,1.4,1.6,2.0,2.4,3.5]),[1])   # measured minutes
+3 XorGate("=Emp([[0,3],[1,7]],1)([1])")                        # 30% rework (value 0)
+4 Task(*fit([1.0,1.2,0.8,1.1,0.9,1.3,1.0,1.05]))               # best fitted distribution
+5 End()
+1->2; 2->3; 3->5;
+            3->4; 4->5
+"""
+ex35="""
+# Call center week - shifts of agents follow the daily profile of calls
+1 Start(Rate([0,7,11,17,21],[2,24,12,4,2],24),None,168.0)
+2 Task(E,[0.25],None,Shift([[0,1],[7,6],[11,4],[17,2],[21,1]],24))
+3 End()
+1->2; 2->3
+"""
+ex36="""
+# Four phases process of ex8 with its parallel block defined once (first node - entry, last - exit)
+def Checks       # four parallel checks
+1 AndGate()
+2 Task(U,[1.0,3.0])
+3 Task(U,[1.0,3.0])
+4 Task(U,[1.0,3.0])
+5 Task(U,[1.0,3.0])
+6 AndGate()
+1->2; 1->3; 1->4; 1->5; 2->6; 3->6; 4->6; 5->6
+end
+1 Start(E,[2.0],20.0)
+2 Task(U,[2.0,3.0])  # registration
+3 Checks()           # first checks
+4 Task(U,[2.0,3.0])  # correction
+5 Checks()           # final checks
+6 End()
+1->2; 2->3; 3->4; 4->5; 5->6
+"""
+ex37="""
+# Unbalanced gateways - two of three parallel branches join first, the third one at the outer join
+1 Start(E,[2.0],20.0)
+2 AndGate()
+3 Task(U,[1.0,2.0])
+4 Task(U,[1.0,3.0])
+5 Task(U,[2.0,5.0])
+6 AndGate()
+7 AndGate()
+8 End()
+1->2; 2->3; 2->4; 2->5; 3->6; 4->6; 6->7; 5->7; 7->8
+"""
+exbad=[  # hostile models, all rejected by ModelError (python des.py check)
+'1 Start()\n2 Script("S.x=\'{0.__init__.__globals__}\'.format(self)")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.x=str.format(\'{0.__init__}\',self)")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.x=[g.gi_frame.f_globals for g in [(i for i in [])]]")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Task(Emp("/etc/passwd"),[1])\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Task(*fit("/etc/passwd"))\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.q=[Emp][0](\'/etc/passwd\').q[-1]")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.f=Emp;S.q=S.f(\'/etc/passwd\').q[-1]")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.q=[fit][0](\'/etc/passwd\')")\n3 End()\n1->2; 2->3',
+'1 Start()\n2 Script("S.x=__import__(\'os\')")\n3 End()\n1->2; 2->3',
+]
+def check_models(bad=exbad):  # number of hostile models accepted (should be 0)
+      global TRUSTED
+      t,TRUSTED,k = TRUSTED,False,0
+      for s in bad:
+            try:
+                  simulate(s,1,0,(),5)  # parsed and run
+                  print("accepted:",s)
+                  k += 1
+            except ModelError:
+                  pass
+      TRUSTED = t
+      return k
 ne=[]
+# ---- snapshots -----
+def snapshot(sim,ne,z=6):  # complete state of a (paused) simulation as bytes (z - compression level)
+      import pickle,zlib
+      st = {"sim":sim,"ne":ne,"inst":QueuedEvent.instances,"S":BpmnEvent.S,"P":BpmnEvent.P,
+            "cnt":(Event.cnt,Customer.cnt),"random":random.getstate(),"RNG":dict(RNG),
+            "rng":None if _rng is random else _rng}
+      b = pickle.dumps(st,pickle.HIGHEST_PROTOCOL)
+      return z and b"DES1"+zlib.compress(b,z) or b"DES0"+b
+def restore(b):       # simulator and network of a snapshot
+      import pickle,zlib
+      global _rng
+      if b[:4] not in (b"DES0",b"DES1"):
+            raise ValueError("not a simulation snapshot")
+      st = pickle.loads(b[4:] if b[3:4]==b"0" else zlib.decompress(b[4:]))
+      QueuedEvent.instances[:] = st["inst"]
+      BpmnEvent.S, BpmnEvent.P = st["S"], st["P"]
+      Event.cnt, Customer.cnt = st["cnt"]
+      random.setstate(st["random"])
+      RNG.update(st["RNG"])
+      _rng = st["rng"] or random
+      globals()["ne"] = st["ne"]
+      return st["sim"],st["ne"]
+def save(fn,sim,ne):  # snapshot to a file
+      with open(fn,"wb") as f:
+            f.write(snapshot(sim,ne))
+def load(fn):         # i.e. s,ne = load("day3.des"); ne[1].servers(4,s); s.run()
+      with open(fn,"rb") as f:
+            return restore(f.read())
+_NETS = {}            # parsed networks (snapshots) by model text (and TRUSTED), for repeated requests
+def network(text):    # fresh network of a model without parsing it again
+      global ne
+      k = (text,TRUSTED)      # networks of the host may hold file data
+      if k not in _NETS:
+            if len(_NETS)>=64: _NETS.pop(next(iter(_NETS)))
+            set_seed()
+            ne = EventNetwork(text)
+            _NETS[k] = snapshot(None,ne,0)
+      return restore(_NETS[k])[1]
+def simulate(text,n=1,seed=None,what=("stats",),cpu=None,deadline=None):  # results and drawings in memory (for servers)
+      import time
+      global ne
+      st,tt,r,c0 = Stat(),[],{},time.process_time()
+      _OUT.clear()
+      for i in range(n):
+            ne = network(text)
+            if seed==None: random.seed()
+            set_seed(seed if seed==None or n==1 else "%s.%d"%(seed,i))
+            s = new_sim(ne)
+            _limits(s,c0,cpu,deadline)
+            ne.T = s.time
+            st.add(s.time)
+            tt.append(s.time)
+            if i==0:
+                  r["S"] = {k:v for k,v in BpmnEvent.S.items() if isinstance(v,(int,float,str,list))}
+                  if "stats" in what: r["stats"] = stats_tostring(ne.ee,ne.T)
+                  if "bpmn" in what or "bpmn_svg" in what: r["bpmn"] = to_bpmn(ne.ee,ne.pp)
+                  if "bpmn_svg" in what:
+                        import io
+                        r["bpmn_svg"] = bpmn_tosvg(io.StringIO(r["bpmn"]))
+                  if "svg" in what: r["svg"] = to_chart(ne.ee)
+                  if "dot" in what: r["dot"] = to_dot()
+      r.update({"n":n,"t":tt,"mean":st.mean,"hw":st.hw() if n>1 else None,"out":"".join(_OUT),"version":ENGINE})
+      return r
+def _limits(s,c0,cpu=None,deadline=None):  # run within cpu seconds (since c0) and wall clock deadline (time.time())
+      import time
+      for _ in s.iterate(10000):
+            if cpu and time.process_time()-c0>cpu:
+                  raise TimeoutError("cpu limit of %g s exceeded"%cpu)
+            if deadline and time.time()>deadline:
+                  raise TimeoutError("time limit exceeded")
+def replicate(text,i0,k,seed=None,out=None,cpu=None,deadline=None):  # replications i0..i0+k-1 of a job (cpu - seconds)
+      import time
+      global ne
+      c0,vv = time.process_time(),[]
+      for i in range(i0,i0+k):
+            _OUT.clear()      # output of models is not kept by jobs
+            ne = network(text)
+            if seed==None: random.seed()
+            set_seed(seed if seed==None else "%s.%d"%(seed,i))
+            s = new_sim(ne)
+            _limits(s,c0,cpu,deadline)
+            vv.append(output(s,ne,out))
+      return vv,time.process_time()-c0
+# ---- replications -----
+def new_sim(ne):     # simulator with generating events of the network
+      s = Simulator()
+      for e in ne:
+            if isinstance(e,Generator):  # add generating events
+                  if isinstance(e.fun,Rate):
+                        e.time = e.next(e.time)   # first arrival of time dependent rate
+                        if e.tmax>0 and e.time>e.tmax: continue
+                  s.add(e)
+            if getattr(e,"shift",None):  # calendar of servers
+                  e.shift.start(e,s)
+      return s
+def output(s,ne,out=None): # replication result: end time, "S.*", node statistic "id.key" or function
+      if out==None:
+            return s.time
+      if callable(out):
+            return out(s,ne)
+      if out[0].isdigit():     # i.e. "3.w" - mean waiting time in node 3
+            i,k = out.split(".")
+            return node_stat(ne[int(i)-1],s.time).report(s.time)[k]
+      return BpmnEvent.S[out]
+def run_rep(exn,out=None,seed=None,anti=False):  # single replication
+      global ne
+      if isinstance(exn,tuple):   # difference of two scenarios (common random numbers if seeded)
+            return run_rep(exn[0],out,seed,anti)-run_rep(exn[1],out,seed,anti)
+      set_seed(seed,anti)
+      ne = EventNetwork(exn)
+      s = new_sim(ne)
+      s.run()
+      return output(s,ne,out)
+def _rep(a):         # pool worker (out must be picklable: None, "S.*" or module function)
+      return run_rep(*a)
+def run_batch(exn,n,out=None,procs=1,i0=0,seed=None,anti=False): # replications i0..i0+n-1
+      aa = [(exn,out) for _ in range(n)]
+      if seed!=None:      # replication seeds (antithetic pairs share one)
+            aa = [(exn,out,"%s.%d"%(seed,anti and i//2 or i),anti and i%2==1) for i in range(i0,i0+n)]
+      if procs>1:
+            import multiprocessing
+            with multiprocessing.Pool(procs,random.seed) as pool:  # own seed in every worker
+                  return pool.map(_rep,aa)
+      return [_rep(a) for a in aa]
+def main_seq(exn,out=None,rel=0.05,alpha=0.05,nmin=10,nmax=1000,batch=10,procs=1,seed=None,anti=False):
+      st,i = Stat(),0  # add replications in batches until relative CI half-width <= rel
+      anti = anti and seed!=None
+      while i<nmax:   # exn may be a tuple of two scenarios to compare
+            k = min(i==0 and max(nmin,2) or batch, nmax-i)
+            k += anti and k%2   # whole antithetic pairs
+            xx = run_batch(exn,k,out,procs,i,seed,anti)
+            i += k
+            if anti:  # pair means are independent
+                  xx = [(xx[j]+xx[j+1])/2 for j in range(0,len(xx),2)]
+            for x in xx:
+                  st.add(x)
+            if abs(st.hw(alpha))<=rel*abs(st.mean):
+                  break
+      r = st.n>1 and st.hw(alpha)/abs(st.mean or 1) or math.inf
+      print("n=%d mean=%g hw=%g rel=%.4f%s"%(i,st.mean,st.hw(alpha),r,r>rel and " (nmax reached)" or ""))
+      return st
+def node_stats(s,ne):  # replication output with statistics of all nodes
+      return [node_stat(e,s.time) for e in ne]
+def main_stats(exn,n,procs=1,seed=None):  # node statistics merged over replications
+      ss = None
+      for x in run_batch(exn,n,node_stats,procs,0,seed):
+            ss = ss and [a.merge(b) for a,b in zip(ss,x)] or x
+      for e,st in zip(EventNetwork(exn),ss):
+            if isinstance(e,Sink):
+                  print(e.id,"cycle time p50/p95/p99: %g %g %g"%tuple(st.sq.quantiles([0.5,0.95,0.99])))
+      return ss
+def main_steady(exn,node=None,nc=None,kmax=512,dt=1.0,alpha=0.05,b=20,seed=None):
+      global ne     # one long run: cycle times of sinks (or queue lengths of node id)
+      set_seed(seed)
+      ne = EventNetwork(exn)
+      ser = Series(kmax,dt)
+      for e in ne:
+            if nc!=None and isinstance(e,Generator):
+                  e.tmax = -nc  # number of customers
+            if node==None and isinstance(e,Sink) or e.id==node:
+                  e.st.ser = ser
+      s = new_sim(ne)
+      s.run()
+      if node!=None:
+            ser.hold(s.time,0)
+      r = ser.ci(alpha,b)
+      print("n=%d warm-up=%d mean=%g hw=%g (%d batches)"%(r["n"],r["d"],r["mean"],r["hw"],r["b"]))
+      return r
 # ---- simulation -----
 def main_fun(exn,n): # string representation, number of simulation
       data=[]  # list of events, array of results
       for _ in range(n):
             global ne
             ne = EventNetwork(exn)
-            s = Simulator()
-            for e in ne:
-                  if isinstance(e,Generator):  # add generating events
-                        s.add(e)  
+            s = new_sim(ne)
             s.run()
-            
+            ne.T = s.time
             if exn==ex5:
                   data.append(BpmnEvent.S["S.bA"]) # save global variable S.bA
             else:
@@ -1223,25 +2550,25 @@ def main_fun(exn,n): # string representation, number of simulation
             if _==0:
                   print(to_bpmn(ne.ee,ne.pp),file=open('des.bpmn','w'))
                   print(bpmn_tosvg('des.bpmn'),file=open('des_bpmn.svg','w'))
-                  print(to_svg(),file=open('des.svg','w'))
+                  with open('des.svg','w') as f: to_chart(ne.ee,f)
                   print(to_dot(),file=open('des.dot','w'))
             for nn in [1,2,3,4,5,6,7,8,9,10,11,12]:
                   if eval("exn==ex"+str(nn)):
-                        print(to_svg(),file=open('ex'+str(nn)+'_des.svg','w'))
+                        with open('ex'+str(nn)+'_des.svg','w') as f: to_svg(ne.ee,f)
                         print(bpmn_tosvg('des.bpmn'),file=open('ex'+str(nn)+'_bpmn.svg','w'))         
       for e in ne:
             if len(e.queue)>0:
                   print(e.id,"(%d):"%len(e.queue),e.queue)
                   print(e.id,"(%d):"%len(e.queue),e.queue,file=open("des.out","w"))
-      print(sum(data)/len(data))
-      print(sum(data)/len(data),file=open("des.out","a"))
+      st = Stat()
+      for x in data: st.add(x)
+      print(st)       # mean with 95% confidence interval half-width
+      print(st,file=open("des.out","a"))
       print(BpmnEvent.S)
+      print(stats_tostring(ne.ee,ne.T))  # node statistics of the last replication
       s=''
       for e in ne:
             s+=str(e.id)+str(e.A)+' '
-            if isinstance(e,Task):
-                  for i in range(len(e.servers)):
-                        s+=str(e.servers[i].id)+'/'+str(i+1)+str(e.servers[i].A)+' '                        
       print(s)
       if len(data)>100:
             if exn==ex4:
@@ -1255,11 +2582,19 @@ def main_fun(exn,n): # string representation, number of simulation
 # ----- main with args ------
 if __name__=="__main__":
       import sys
-      s = len(sys.argv)>1 and from_file(sys.argv[1]) or eval('ex'+str(28))
+      if sys.argv[1:]==["check"]:
+            sys.exit(check_models()>0)
+      TRUSTED = "-u" not in sys.argv  # own models may read data files (-u: model of somebody else)
+      if not TRUSTED: sys.argv.remove("-u")
+      s = len(sys.argv)>1 and (from_bpmn if sys.argv[1].endswith(".bpmn") else from_file)(sys.argv[1]) or eval('ex'+str(28))
       n = len(sys.argv)>2 and int(sys.argv[2]) or 1
+      rel = len(sys.argv)>3 and float(sys.argv[3]) or 0  # target relative precision (sequential)
       #print(s)
       
-      ne = main_fun(s,n)
+      if rel>0:
+            main_seq(s,rel=rel,nmax=n)
+      ne = main_fun(s,1 if rel>0 else n)
+      if not TRUSTED: sys.stdout.write("".join(_OUT))  # print of the model
       #for nn in range(1,12+1): print("%d:"%nn),main_fun(eval('ex'+str(nn)),n)
       print(T([1,21]))
 """
@@ -19,6 +19,7 @@ class Simulator():
             self.time = 0
             self.events = []
             self.conditions = []
+            self.n = 0            # executed events
       def now(self):
             return self.time
       def add(self,e):
@@ -27,15 +28,33 @@ class Simulator():
       def add_condition(self,e):
             self.conditions.append(e)
             return(self)
-      def run(self):
-            while self.events:
+      def step(self,n=1,tmax=None):       # execute at most n events not later than tmax
+            k = 0
+            while k<n and self.events:
                   e = min(self.events, key=lambda e: e.time)
+                  if tmax!=None and e.time>tmax:
+                        self.time = tmax       # paused
+                        break
                   self.events.remove(e)
                   self.time = e.time         # update simulator time
                   e.exec(self)
                   for c in self.conditions:  # test conditions
                         if c.exec(self):
                               self.conditions.remove(c)
+                  k += 1
+            self.n += k
+            return k
+      def run(self,tmax=None):            # until no events (or paused at time tmax)
+            self.step(float("inf"),tmax)
+      def run_until(self,t):
+            self.run(t)
+      def iterate(self,k=1000,tmax=None): # cooperative run yielding progress every k events
+            while True:
+                  m = self.step(k,tmax)
+                  yield {"time":self.time,"n":self.n,"events":len(self.events),
+                         "done":None if tmax is None else (self.time/tmax if tmax else 1.0)}
+                  if m<k:
+                        return
 # ---- utils ----
 import math,random
 def _print(s):                # own print
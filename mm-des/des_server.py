@@ -0,0 +1,358 @@
+# DES server - long-lived simulation service (asyncio http, warm worker processes)
+# usage: python des_server.py [port=8008] [workers=cpu count] [batch workers=cpu count/2]
+# - POST/GET /simulate  ex=<model text>&n=<replications>&seed=<seed>&format=html|json&cpu=<s>&time=<s>
+# - POST /jobs  ex=<model>&n=<replications>&seed=<seed>&out=<S.x|id.key>&rel=<precision>&cpu=<s>&time=<s>
+# - GET /jobs/<id> (status), GET /jobs/<id>/events (server-sent events), DELETE /jobs/<id> (cancel)
+# - GET /version
+# results and drawings are returned in memory (no des.in, des.svg, ... files)
+# seeded /simulate results are cached on disk (DES_CACHE directory, DES_CACHE_MB size)
+# workers run under cpu and memory (DES_MEM_MB) limits of the system, stuck ones are killed and replaced
+import asyncio,hashlib,json,math,os,sys,time
+from urllib.parse import urlsplit,parse_qs
+from html import escape
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+try:
+      import resource
+except ImportError:           # Windows: no cpu and memory limits of workers by the system
+      resource = None
+import des
+
+MAXBODY = 1<<20               # max size of a posted model
+MAXJOBS = 16                  # queued and running jobs (admission control)
+MAXN = 100000                 # replications of a job
+CPULIMIT = 600.0              # default cpu seconds of a job
+TIMELIMIT = 1800.0            # default wall clock seconds of a job
+SIMCPU = 60.0                 # cpu seconds of a /simulate request (at most)
+SIMTIME = 60.0                # wall clock seconds of a /simulate request (at most)
+GRACE = 1.0                   # seconds after a deadline before workers still busy are killed
+MAXMEM = int(os.environ.get("DES_MEM_MB",2048))<<20  # address space of a worker
+POOL = None                   # warm worker processes (interactive requests)
+BATCH = None                  # worker processes of jobs (lower priority)
+PARGS = {}                    # arguments of _pool by pool name (new workers for killed ones)
+SLOTS = None                  # chunks of jobs in workers
+JOBS = {}                     # jobs by id
+SEED = "1"                    # default seed of /simulate (seed=none for unseeded and not cached runs)
+CACHEDIR = os.environ.get("DES_CACHE",os.path.join(os.path.dirname(os.path.abspath(__file__)),"des_cache"))
+CACHEMAX = int(os.environ.get("DES_CACHE_MB",256))<<20
+CACHE = None                  # result cache (of the process)
+
+class Cache():                # content addressed results on disk (lru by modification time, size bounded)
+      def __init__(self,dir,maxsize=CACHEMAX):
+            self.dir, self.maxsize, self.size, self.n = dir, maxsize, None, 0
+            os.makedirs(dir,exist_ok=True)
+      def key(self,text,*args):  # hash of normalized model text, engine version and parameters
+            ll = [s.rstrip() for s in text.replace("\r","").split("\n")]
+            ll = [s for s in ll if len(s.strip())>1 and s.strip()[0]!="#"]  # lines read by the parser
+            return hashlib.sha256(json.dumps([des.ENGINE,"\n".join(ll)]+[str(a) for a in args]).encode("utf-8")).hexdigest()
+      def get(self,k):
+            fn = os.path.join(self.dir,k+".json")
+            try:
+                  with open(fn,"rb") as f:
+                        r = json.loads(f.read())
+                  os.utime(fn)        # recently used
+                  return r
+            except (OSError,ValueError):  # missing, evicted meanwhile or damaged
+                  return None
+      def put(self,k,r):        # atomic: readers see the old or the whole new file
+            b = json.dumps(r).encode("utf-8")
+            fn = os.path.join(self.dir,k+".json")
+            tmp = "%s.%d.%s.tmp"%(fn,os.getpid(),os.urandom(4).hex())
+            with open(tmp,"wb") as f:
+                  f.write(b)
+            os.replace(tmp,fn)
+            self.n += 1
+            if self.size==None or self.n%32==0:  # other processes write too
+                  self.evict()
+            self.size += len(b)
+            if self.size>self.maxsize:
+                  self.evict()
+      def evict(self):          # least recently used first, down to 90% of the size
+            ff,t = [],time.time()
+            for e in os.scandir(self.dir):
+                  try:
+                        st = e.stat()
+                        if e.name.endswith(".tmp") and t-st.st_mtime>3600:  # of crashed writers
+                              os.remove(e.path)
+                        elif e.name.endswith(".json"):
+                              ff.append((st.st_mtime,st.st_size,e.path))
+                  except OSError:
+                        pass
+            ff.sort()
+            self.size = sum(f[1] for f in ff)
+            if self.size<=self.maxsize: return
+            for _,n,fn in ff:
+                  if self.size<=0.9*self.maxsize: break
+                  try:
+                        os.remove(fn)
+                  except OSError:
+                        pass
+                  self.size -= n
+
+def _warm(nice=0,cachedir=None):  # worker initializer (des imported and ready)
+      global CACHE
+      des.set_seed()
+      if nice and hasattr(os,"nice"):
+            os.nice(nice)     # heavy studies do not slow down interactive requests
+      if resource and MAXMEM:
+            resource.setrlimit(resource.RLIMIT_AS,(MAXMEM,resource.getrlimit(resource.RLIMIT_AS)[1]))  # MemoryError in a model
+      if cachedir:
+            CACHE = Cache(cachedir)
+      return os.getpid()
+def _limited(cpu,fun,*args):  # in a worker: fun(*args), killed by the system (SIGXCPU) after 1 s more than cpu seconds
+      if resource and cpu:    # even inside one expression (i.e. sum(range(10**12))), where des checks no limits
+            u,(soft0,hard) = resource.getrusage(resource.RUSAGE_SELF),resource.getrlimit(resource.RLIMIT_CPU)
+            soft = math.ceil(u.ru_utime+u.ru_stime+cpu)+1
+            resource.setrlimit(resource.RLIMIT_CPU,(soft if hard==resource.RLIM_INFINITY else min(soft,hard),hard))
+      try:
+            return fun(*args)
+      finally:
+            if resource and cpu:
+                  resource.setrlimit(resource.RLIMIT_CPU,(soft0,hard))
+def _pool(n,nice=0,cachedir=None):  # warm worker processes
+      return ProcessPoolExecutor(n,initializer=_warm,initargs=(nice,cachedir))
+def _renew(name,pool,kill=True):  # new workers of POOL or BATCH for a broken pool or for killing stuck ones
+      if globals()[name] is pool:
+            globals()[name] = _pool(*PARGS[name])
+      if kill:
+            pool.killed = True  # its futures fail with BrokenProcessPool, not by their fault
+            for p in list((pool._processes or {}).values()):
+                  p.kill()
+      pool.shutdown(wait=False,cancel_futures=True)
+async def _run(name,cpu,deadline,fun,*args):  # fun(*args) in a worker of POOL or BATCH within cpu seconds and deadline
+      for retry in (True,False):
+            pool,t = globals()[name],time.time()
+            f = asyncio.get_running_loop().run_in_executor(pool,_limited,cpu,fun,*args)
+            try:
+                  await asyncio.wait({f},timeout=max(0,deadline-t))
+            except asyncio.CancelledError:  # the worker is still busy: keep its slot until the deadline at most
+                  await asyncio.wait({f},timeout=max(0,deadline-time.time()))
+                  raise
+            finally:
+                  if not f.done():  # stuck in one expression
+                        f.add_done_callback(lambda f: f.cancelled() or f.exception())  # BrokenProcessPool, expected
+                        _renew(name,pool)
+            if not f.done():
+                  raise TimeoutError("time limit exceeded")
+            try:
+                  return f.result()
+            except BrokenProcessPool:  # a worker was killed: by us, by the system for its cpu, or by the system for memory
+                  _renew(name,pool,False)
+                  if not retry or not getattr(pool,"killed",False) and time.time()-t>=cpu:
+                        raise TimeoutError("cpu limit of %g s exceeded"%cpu)  # not shorter than the cpu given: may be ours
+def _simulate(text,n,seed,what,k=None,cpu=None,deadline=None):  # in a worker: simulate and store in the cache
+      r = des.simulate(text,n,seed,what,cpu,deadline)
+      if k and CACHE: CACHE.put(k,r)
+      return r
+def fields(query,body,ctype):  # request fields of query string and form or json body
+      q = {k:v[0] for k,v in parse_qs(query).items()}
+      if body:
+            if "json" in ctype:
+                  q.update(json.loads(body))
+            else:
+                  q.update({k:v[0] for k,v in parse_qs(body.decode("utf-8")).items()})
+      return q
+def html(r):                  # page formerly assembled by des.php from files
+      m = "%g"%r["mean"] if r["hw"]==None else "%g +/- %g"%(r["mean"],r["hw"])
+      s = "<pre>%s (n=%d)\n%s\n%s</pre>\n"%(m,r["n"],r["S"],r.get("stats",""))
+      if r.get("out"): s += "<pre>"+escape(r["out"])+"</pre>\n"  # print of the model
+      s += "<div>"+r.get("bpmn_svg","")+"</div>\n"
+      s += "<div>"+r.get("svg","")+"</div>\n"
+      return s
+async def simulate(q):        # run in a worker process
+      n = int(q.get("n",1))
+      if not 0<n<=MAXN:
+            raise ValueError("n must be in 1..%d"%MAXN)
+      cpu = min(float(q.get("cpu",SIMCPU)),SIMCPU)
+      deadline = time.time()+min(float(q.get("time",SIMTIME)),SIMTIME)
+      seed = q.get("seed") or SEED
+      if seed=="none": seed = None
+      fmt = q.get("format","html")
+      what = q.get("what","stats,bpmn_svg,svg" if fmt=="html" else "stats")
+      if isinstance(what,str): what = what.split(",")
+      what = tuple(sorted(what))
+      k = CACHE and seed!=None and CACHE.key(q["ex"],seed,n,what)
+      r = k and CACHE.get(k)
+      if not r:
+            r = await _run("POOL",cpu,deadline+GRACE,_simulate,q["ex"],n,seed,what,k,cpu,deadline)
+      if fmt=="html":
+            return "text/html; charset=utf-8",html(r)
+      return "application/json",json.dumps(r)
+
+# ---- jobs ----
+class Job():                  # replications run in chunks by batch workers
+      def __init__(self,q):
+            self.id = os.urandom(6).hex()
+            self.text, self.n = q["ex"], int(q.get("n",100))
+            self.seed, self.out = q.get("seed") or None, q.get("out") or None
+            self.rel = float(q.get("rel",0))      # stop at relative half-width
+            self.cpu = float(q.get("cpu",CPULIMIT))
+            self.tmax = float(q.get("time",TIMELIMIT))
+            if not 0<self.n<=MAXN:
+                  raise ValueError("n must be in 1..%d"%MAXN)
+            self.status, self.error, self.t0, self.used = "queued", None, time.time(), 0.0
+            self.deadline = self.t0+self.tmax
+            self.reserved, self.running = 0.0, 0  # cpu seconds given to chunks in workers, and their number
+            self.st, self.vv, self.tasks = des.Stat(), [], []
+            self.changed = asyncio.Event()
+      def state(self):
+            hw = self.st.hw() if self.st.n>1 else None
+            return {"id":self.id,"status":self.status,"n":self.n,"done":self.st.n,"mean":self.st.mean if self.st.n else None,
+                    "hw":hw,"cpu":round(self.used,3),"time":round(time.time()-self.t0,3),"error":self.error}
+      def notify(self):
+            ev,self.changed = self.changed,asyncio.Event()
+            ev.set()
+      def finished(self):
+            return self.status not in ("queued","running")
+      def stop(self,status,error=None):  # cancel not started chunks
+            if self.finished(): return
+            self.status, self.error = status, error
+            for t in self.tasks:
+                  t.cancel()
+            self.notify()
+      def enough(self):       # sequential stopping at relative precision
+            return self.rel>0 and self.st.n>=10 and self.st.hw()<=self.rel*abs(self.st.mean)
+      async def chunk(self,i0,k):
+            async with SLOTS:
+                  if self.finished(): return
+                  self.status = "running"
+                  b = (self.cpu-self.used-self.reserved)/max(1,BATCH._max_workers-self.running)  # share of the rest
+                  self.reserved, self.running = self.reserved+b, self.running+1
+                  try:
+                        vv,used = await _run("BATCH",b,self.deadline+GRACE,des.replicate,self.text,i0,k,self.seed,
+                                             self.out,b,self.deadline)
+                  except TimeoutError as e:
+                        self.used += b
+                        self.stop("failed","%s limit of %g s exceeded"%(("time",self.tmax) if "time" in str(e) else ("cpu",self.cpu)))
+                        return
+                  except Exception as e:
+                        self.stop("failed","%s: %s"%(e.__class__.__name__,e))
+                        return
+                  finally:
+                        self.reserved, self.running = self.reserved-b, self.running-1
+            if self.finished(): return
+            self.used += used
+            for v in vv:
+                  self.st.add(float(v))
+            self.vv += vv
+            if self.used>self.cpu:
+                  self.stop("failed","cpu limit of %g s exceeded"%self.cpu)
+            elif self.enough():
+                  self.stop("done")
+            self.notify()
+      async def run(self):
+            k = max(1,min(100,self.n//(10*BATCH._max_workers)))  # chunk size (progress and cancel granularity)
+            self.tasks = [asyncio.ensure_future(self.chunk(i,min(k,self.n-i))) for i in range(0,self.n,k)]
+            done,pending = await asyncio.wait(self.tasks,timeout=max(0,self.deadline-time.time()))
+            if pending:     # workers stop by the deadline themselves, or are killed soon after
+                  self.stop("failed","time limit of %g s exceeded"%self.tmax)
+            if not self.finished():
+                  self.status = "done"
+            self.notify()
+def _parse(text):             # in a worker: model errors of a job (node parameters and Start scripts are run)
+      des.network(text)
+async def submit(q):          # new job (or error if the server is full)
+      if "ex" not in q:
+            raise ValueError("missing model (ex)")
+      if sum(1 for j in JOBS.values() if not j.finished())>=MAXJOBS:
+            return None
+      for i in [i for i,j in JOBS.items() if j.finished()][:max(0,len(JOBS)-4*MAXJOBS)]:
+            del JOBS[i]       # forget the oldest finished jobs
+      j = Job(q)
+      JOBS[j.id] = j          # admitted while parsed
+      try:
+            await _run("POOL",min(j.cpu,SIMCPU),min(j.deadline,time.time()+SIMTIME),_parse,j.text)  # model errors are reported now
+      except BaseException:
+            del JOBS[j.id]
+            raise
+      asyncio.ensure_future(j.run())
+      return j
+async def events(j,writer):   # server-sent events with partial results until the job finishes
+      writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+      while True:
+            ev = j.changed
+            writer.write(("data: %s\n\n"%json.dumps(j.state())).encode("utf-8"))
+            await writer.drain()
+            if j.finished(): break
+            await ev.wait()
+
+# ---- http ----
+async def route(method,path,q,writer):  # status, content type and body (or None if already written)
+      pp = path.strip("/").split("/")
+      if pp[0]=="simulate":
+            if "ex" not in q:
+                  raise ValueError("missing model (ex)")
+            return ("200 OK",)+await simulate(q)
+      if pp[0]=="jobs" and len(pp)==1 and method=="POST":
+            j = await submit(q)
+            if j==None:
+                  return "503 Service Unavailable","application/json",json.dumps({"error":"too many jobs"})
+            return "202 Accepted","application/json",json.dumps(j.state())
+      if pp[0]=="jobs" and len(pp)>1:
+            j = JOBS.get(pp[1])
+            if j==None:
+                  return "404 Not Found","text/plain","no job "+pp[1]
+            if method=="DELETE" or pp[-1]=="cancel":
+                  j.stop("cancelled")
+            elif pp[-1]=="events":
+                  await events(j,writer)
+                  return None
+            r = j.state()
+            if j.status=="done": r["values"] = j.vv
+            return "200 OK","application/json",json.dumps(r)
+      if pp[0]=="version":
+            return "200 OK","text/plain",des.ENGINE
+      return "404 Not Found","text/plain","not found"
+async def handle(reader,writer):
+      try:
+            head = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+            method,target = head[0].split(" ")[:2]
+            hh = {}
+            for h in head[1:]:
+                  k,_,v = h.partition(":")
+                  hh[k.strip().lower()] = v.strip()
+            m = int(hh.get("content-length",0))
+            if m>MAXBODY:
+                  raise ValueError("model too large")
+            body = await reader.readexactly(m) if m else b""
+            url = urlsplit(target)
+            r = await route(method,url.path,fields(url.query,body,hh.get("content-type","")),writer)
+      except (ConnectionError,asyncio.IncompleteReadError):
+            r = None
+      except Exception as e:  # bad request or model
+            r = "400 Bad Request","text/plain","%s: %s"%(e.__class__.__name__,e)
+      if r!=None:
+            b = r[2].encode("utf-8")
+            writer.write(("HTTP/1.1 %s\r\nContent-Type: %s\r\nContent-Length: %d\r\nConnection: close\r\n\r\n"
+                          %(r[0],r[1],len(b))).encode("latin-1")+b)
+      try:
+            await writer.drain()
+      except ConnectionError:
+            pass
+      finally:
+            writer.close()
+async def serve(port):
+      global SLOTS
+      SLOTS = asyncio.Semaphore(BATCH._max_workers)  # bounded: no backlog inside the pool
+      server = await asyncio.start_server(handle,"127.0.0.1",port)
+      async with server:
+            await server.serve_forever()
+def main(port=8008,workers=None,batch=None):
+      global POOL,BATCH,CACHE
+      workers = workers or os.cpu_count()
+      batch = batch or max(1,workers//2)
+      CACHE = CACHEMAX>0 and Cache(CACHEDIR) or None
+      PARGS.update({"POOL":(workers,0,CACHE and CACHEDIR),"BATCH":(batch,10)})
+      POOL,BATCH = _pool(*PARGS["POOL"]),_pool(*PARGS["BATCH"])
+      for f in [POOL.submit(os.getpid) for _ in range(workers)]+[BATCH.submit(os.getpid) for _ in range(batch)]:
+            f.result()        # start all workers now
+      print("des server %s on port %d (%d+%d workers)"%(des.ENGINE,port,workers,batch))
+      try:
+            asyncio.run(serve(port))
+      finally:
+            POOL.shutdown()
+            BATCH.shutdown(cancel_futures=True)
+
+# ----- main with args ------
+if __name__=="__main__":
+      main(*[int(a) for a in sys.argv[1:4]])